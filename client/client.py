@@ -1,23 +1,83 @@
+import argparse
 import asyncio
+import collections
+import concurrent.futures
 import websockets
 import json
+import sys
 import time
-import copy
 import traceback
 from competitor import Competitor
 from controller import Controller
-from visualizer import Visualizer
+from turn_history import TurnHistory
+import protocol
 
 WAITING, PLAYING = 0, 1
 ENABLE_PRINT = False
+# Encoding of turns and game updates requested at login: protocol.JSON, or 
+# protocol.BINARY for smaller messages that are faster to encode and decode
+ENCODING = protocol.JSON
+# Seconds play_turn may run before the actions it has chosen so far are 
+# submitted. The server ends a turn after 3 seconds; the rest is left for the 
+# network.
+TURN_TIME_BUDGET = 2.5
+URI = "ws://cpw.battlecode.org:8001/"
+#URI = "ws://localhost:8001/"
+# Number of finished games kept in game_history
+GAME_HISTORY_SIZE = 100
 
 status = WAITING
 game_id = None
 competitor = None
 op_username = ""
-game_history = []
-visualizer = Visualizer()
+# TurnHistory of the game being played
+history = None
+# game_over messages of the last GAME_HISTORY_SIZE games
+game_history = collections.deque(maxlen=GAME_HISTORY_SIZE)
 exceptions = ""
+# encoding confirmed by the server
+encoding = protocol.JSON
+# seconds play_turn ran on the last turn (until its actions were submitted if
+# it ran over TURN_TIME_BUDGET), or None before the first turn
+compute_time = None
+# play_turn runs on this thread, so the connection stays responsive while a
+# bot thinks; a single thread keeps the competitor's turns in order
+turn_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+
+class EventLog:
+    """
+    Stand-in for the Visualizer when running headless: writes one line per
+    game start, game end, error and turn on which play_turn raised, instead
+    of keeping every state for display.
+
+    Representation:
+    file: text file the events are written to, or None to drop them
+    """
+
+    def __init__(self, file=None):
+        self.file = file
+
+    def _write(self, text):
+        if self.file is not None:
+            self.file.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {text}\n")
+            self.file.flush()
+
+    def render_game(self, state, tag):
+        if tag == "begin":
+            self._write(f"game {state['game_id']} against {state['op_name']} started")
+        elif tag == "end":
+            result = "tie" if state["winner"] is None else f"winner {state['winner']}"
+            self._write(f"game {state['game_id']} over: {result}, errors {state['errors']}")
+        elif state.get("exceptions"):
+            self._write(f"turn {state['turn']}: {state['exceptions']}")
+
+    def render_error(self, error):
+        self._write(error)
+
+
+# renders the games; replaced by a Visualizer unless running headless
+visualizer = EventLog()
 
 async def cleanup(websocket):
     websocket.close()
@@ -25,37 +85,71 @@ async def cleanup(websocket):
 async def begin_game(websocket, event):
     if ENABLE_PRINT:
         print('received begin message', event)
-    global game_id, competitor, op_username
+    global game_id, competitor, op_username, history
     game_id = event['game_id']
     competitor = Competitor()
     op_username = event['op_name']
+    history = TurnHistory(event['bots'], event['op_bots'])
     await play_and_submit_turn(websocket, game_id, 0, event['bots'], event['op_bots'], event['op_actions'], event['errors'], competitor)
 
-async def play_and_submit_turn(websocket, game_id, turn, my_bots, op_bots, op_actions, errors, competitor):
-    global exceptions
-    controller = Controller(turn, my_bots, op_bots, op_actions, errors)
+def play_turn(competitor, controller):
+    """
+    Runs competitor.play_turn on the worker thread.
+    Returns the formatted exception it raised, or "" if none.
+    """
     try:
         competitor.play_turn(controller)
-        exceptions = ""
+        return ""
     except Exception:
-        exceptions = traceback.format_exc().replace("\n", " ")
+        return traceback.format_exc().replace("\n", " ")
+
+async def play_and_submit_turn(websocket, game_id, turn, my_bots, op_bots, op_actions, errors, competitor):
+    global exceptions, compute_time
+    start = time.monotonic()
+    controller = Controller(turn, my_bots, op_bots, op_actions, errors, deadline=start + TURN_TIME_BUDGET,
+                            history=history)
+    turn_task = asyncio.get_running_loop().run_in_executor(turn_executor, play_turn, competitor, controller)
+    try:
+        # shielded so an overrunning play_turn is not cancelled, which would 
+        # only drop it from the queue without stopping it
+        exceptions = await asyncio.wait_for(asyncio.shield(turn_task), TURN_TIME_BUDGET)
+        actions = controller.actions
+    except asyncio.TimeoutError:
+        # submit the actions chosen so far; play_turn keeps running on its own
+        # controller, and the next turn waits for it to finish
+        actions = [dict(action) for action in controller.actions]
+        exceptions = f"play_turn ran over the {TURN_TIME_BUDGET}s turn budget, the actions chosen so far were submitted"
+    compute_time = time.monotonic() - start
 
     if ENABLE_PRINT:
-        print('submitting turn', controller.actions)
+        print(f'submitting turn after {compute_time * 1000:.1f} ms', actions)
+    if encoding == protocol.BINARY:
+        message = protocol.encode_turn(game_id, turn, actions)
+        # actions that do not fit the binary layout are sent as json
+        if message is not None:
+            await websocket.send(message)
+            return
     await websocket.send(json.dumps({
         "type": "turn", 
         'game_id': game_id, 
         'turn': turn,
-        "actions": controller.actions}))
+        "actions": actions}))
 
 async def consumer(websocket, message):
     #This is sub-optimal, but there is no easy way around it
-    global status, competitor, game_id
-    event = json.loads(message)
+    global status, competitor, game_id, encoding
+    if isinstance(message, bytes):
+        event = protocol.decode_game_update(message)
+        if event is None:
+            return
+    else:
+        event = json.loads(message)
 
     if event["type"] == "login" and not event['success']:
         visualizer.render_error(f'The username "{Competitor.username}" is already in use. Please quit and use a different username.')
         await cleanup(websocket)
+    elif event["type"] == "login":
+        encoding = event.get("encoding", protocol.JSON)
     elif event['type'] == 'begin_game':
         if ENABLE_PRINT:
             print('beginning game', event)
@@ -65,10 +159,12 @@ async def consumer(websocket, message):
         if ENABLE_PRINT:
             print('game update', event)
         visualizer.render_game(
-            event | { "name": Competitor.username, "op_name": op_username, "exceptions": exceptions},
+            event | { "name": Competitor.username, "op_name": op_username, "exceptions": exceptions,
+                      "compute_time": compute_time},
             "update"
         )
         status = PLAYING
+        history.record_turn(event['turn'], event['bots'], event['op_bots'], event['actions'], event['op_actions'])
         def parse_round_errors(e):
             error_codes = [-1 for _ in range(len(event["op_bots"]))]
             for code, bot in e:
@@ -91,7 +187,7 @@ async def consumer_handler(websocket):
         await consumer(websocket, message)
 
 async def handler(websocket):
-    await websocket.send(json.dumps({"type": "login", "user": Competitor.username}))
+    await websocket.send(json.dumps({"type": "login", "user": Competitor.username, "encoding": ENCODING}))
 
     consumer_task = asyncio.create_task(consumer_handler(websocket))
     done, pending = await asyncio.wait(
@@ -101,13 +197,29 @@ async def handler(websocket):
     for task in pending:
         task.cancel()
 
-async def main():
-    uri = "ws://cpw.battlecode.org:8001/"
-    #uri = "ws://localhost:8001/"
+async def main(uri=URI):
     async with websockets.connect(uri, ssl=None) as websocket:
         await handler(websocket)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Connect your competitor to the game server.")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without the terminal visualizer, e.g. for unattended autoscrims")
+    parser.add_argument("--log", help="file to log games to when headless (default: stdout)")
+    parser.add_argument("--uri", default=URI, help="game server address")
+    args = parser.parse_args()
+
     def execute():
-        asyncio.run(main())
-    visualizer.run(execute)
+        asyncio.run(main(args.uri))
+    if args.headless:
+        visualizer = EventLog(open(args.log, "a") if args.log else sys.stdout)
+        try:
+            execute()
+        except KeyboardInterrupt:
+            pass
+    else:
+        # imported here so headless clients never load curses or start the
+        # visualizer's thread
+        from visualizer import Visualizer
+        visualizer = Visualizer()
+        visualizer.run(execute)
@@ -1,16 +1,47 @@
+import collections
+import functools
+import time
+import protocol
+
+# Number of (state, actions) results remembered by simulate
+SIMULATION_CACHE_SIZE = 1 << 16
+
+# Game state used by the simulation API. It is an immutable tuple, so states
+# can share their bots, be used as dictionary keys and be cached:
+#   turn: number of turns played
+#   my_bots, op_bots: tuple of (health, ammo) tuples, one per bot
+SimState = collections.namedtuple("SimState", ["turn", "my_bots", "op_bots"])
+
+# Actions in the simulation API are tuples: ("none",), ("load",), ("shield",)
+# or ("launch", target, strength)
+NONE_ACTION, LOAD_ACTION, SHIELD_ACTION = ("none",), ("load",), ("shield",)
+
+
 class Controller:
 
-    NUM_BOTS = 3
-    INITIAL_HEALTH, SHIELD_HEALTH = 5, 3
-    NO_ERROR, INVALID_TARGET, DEAD_TARGET, DEAD_BOT_ACTION, NOT_ENOUGH_AMMO = -1, 0, 1, 2, 3
+    # game rules, as defined in protocol
+    NUM_BOTS = protocol.NUM_BOTS
+    INITIAL_HEALTH, SHIELD_HEALTH = protocol.INITIAL_HEALTH, protocol.SHIELD_HEALTH
+    MAX_TURNS = protocol.MAX_TURNS
+    NO_ERROR, INVALID_TARGET = protocol.NO_ERROR, protocol.INVALID_TARGET
+    DEAD_TARGET, DEAD_BOT_ACTION = protocol.DEAD_TARGET, protocol.DEAD_BOT_ACTION
+    NOT_ENOUGH_AMMO = protocol.NOT_ENOUGH_AMMO
+    ONGOING, WIN, LOSS, TIE = 0, 1, 2, 3
+    # action codes used by the history methods are indices in ACTION_TYPES
+    ACTION_TYPES = protocol.ACTION_TYPES
 
-    def __init__(self, turn, my_bots, op_bots, op_actions, errors):
+    def __init__(self, turn, my_bots, op_bots, op_actions, errors, deadline=None, history=None):
         self.turn = turn
+        # time.monotonic() time at which the actions chosen so far are submitted
+        self.deadline = deadline
         self.actions = [{"type": "none"} for _ in range(self.NUM_BOTS)]
         self.player_state = my_bots
         self.opponent_state = op_bots
         self.opponent_actions = op_actions
         self.prev_round_errors = errors
+        self.state = None
+        # TurnHistory of the game so far, or None
+        self.history = history
 
     def reset(self):
         self.actions = [{"type": "none"} for _ in range(self.NUM_BOTS)]
@@ -44,6 +75,17 @@ class Controller:
     def get_turn_num(self):
         return self.turn
 
+    def get_time_remaining(self):
+        """
+        Returns the number of seconds left before the actions chosen so far are
+        submitted, even if play_turn has not returned
+        Returns:
+            (float): seconds left this turn, or None if there is no time limit
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
     def get_my_bot_health(self, bot):
         """
         Returns the health of your team's bot
@@ -102,4 +144,210 @@ class Controller:
         Returns:
             (list[int]): element at i corresponds to error code for bot i in previous round
         """
-        return self.prev_round_errors
\ No newline at end of file
+        return self.prev_round_errors
+
+    def get_health_history(self, bot, opponent=False):
+        """
+        Returns the health of a bot after every turn so far
+        Args:
+            bot (int): index of bot
+            opponent (bool): whether bot is an opponent bot
+        Returns:
+            (memoryview): read-only sequence of ints, element t is the health
+            after turn t (element 0 is the initial health)
+        """
+        return self.history.view("op" if opponent else "my", "health", bot)
+
+    def get_ammo_history(self, bot, opponent=False):
+        """
+        Returns the ammo of a bot after every turn so far
+        Args:
+            bot (int): index of bot
+            opponent (bool): whether bot is an opponent bot
+        Returns:
+            (memoryview): read-only sequence of ints, element t is the ammo
+            after turn t (element 0 is the initial ammo)
+        """
+        return self.history.view("op" if opponent else "my", "ammo", bot)
+
+    def get_action_history(self, bot, opponent=False):
+        """
+        Returns the actions a bot took on every turn so far
+        Args:
+            bot (int): index of bot
+            opponent (bool): whether bot is an opponent bot
+        Returns:
+            (tuple): three read-only sequences of ints (types, targets,
+            strengths); element t is the action taken on turn t, with its type
+            as an index in ACTION_TYPES. Element 0 is always a none action, and
+            targets and strengths are 0 for actions other than launch.
+        """
+        player = "op" if opponent else "my"
+        return (self.history.view(player, "action", bot),
+                self.history.view(player, "target", bot),
+                self.history.view(player, "strength", bot))
+
+    def get_action_counts(self, bot, opponent=False):
+        """
+        Returns how many times a bot took each type of action this game
+        Args:
+            bot (int): index of bot
+            opponent (bool): whether bot is an opponent bot
+        Returns:
+            (memoryview): read-only sequence of ints, indexed like ACTION_TYPES
+        """
+        return self.history.action_counts("op" if opponent else "my", bot)
+
+    def get_state(self):
+        """
+        Returns the current game state, for use with simulate
+        Returns:
+            (SimState): turn number and (health, ammo) of every bot
+        """
+        if self.state is None:
+            self.state = SimState(
+                self.turn,
+                tuple((bot[0], bot[1]) for bot in self.player_state),
+                tuple((bot[0], bot[1]) for bot in self.opponent_state)
+            )
+        return self.state
+
+    def simulate(self, my_actions, op_actions, state=None):
+        """
+        Returns the state after a turn in which both players take the given
+        actions, following the same rules as the server. Invalid actions do
+        nothing, as in a real game. Results are cached, so simulating a turn
+        that was already simulated from the same bots costs a dictionary lookup.
+        Args:
+            my_actions, op_actions: one action tuple per bot (see NONE_ACTION,
+                LOAD_ACTION, SHIELD_ACTION and launch_action). Sequences of
+                action dicts (as in self.actions) are also accepted, but are slower
+            state (SimState): state to simulate from, the current state if None
+        Returns:
+            (SimState): the state after the turn
+        """
+        if state is None:
+            state = self.get_state()
+        if type(my_actions) is not tuple:
+            my_actions = to_action_tuples(my_actions)
+        if type(op_actions) is not tuple:
+            op_actions = to_action_tuples(op_actions)
+        my_bots, op_bots = simulate_bots(state.my_bots, state.op_bots, my_actions, op_actions)
+        return SimState(state.turn + 1, my_bots, op_bots)
+
+    def get_result(self, state):
+        """
+        Returns the outcome of a simulated state
+        Args:
+            state (SimState): state to check
+        Returns:
+            ONGOING, WIN, LOSS or TIE
+        """
+        my_alive = any(bot[0] for bot in state.my_bots)
+        op_alive = any(bot[0] for bot in state.op_bots)
+        if (not my_alive and not op_alive) or state.turn >= self.MAX_TURNS:
+            return self.TIE
+        if not my_alive:
+            return self.LOSS
+        if not op_alive:
+            return self.WIN
+        return self.ONGOING
+
+    def get_valid_actions(self, bot, state=None, opponent=False):
+        """
+        Returns the actions a bot can take without an error
+        Args:
+            bot (int): index of bot
+            state (SimState): state to look at, the current state if None
+            opponent (bool): whether bot is an opponent bot
+        Returns:
+            (tuple): action tuples; only NONE_ACTION for a dead bot
+        """
+        if state is None:
+            state = self.get_state()
+        if opponent:
+            return valid_actions(state.op_bots, state.my_bots, bot)
+        return valid_actions(state.my_bots, state.op_bots, bot)
+
+    def set_actions(self, actions):
+        """
+        Sets the actions of all your bots from action tuples, e.g. the best
+        actions found with simulate
+        Args:
+            actions: one action tuple per bot
+        """
+        for bot, action in enumerate(actions):
+            if action[0] == "launch":
+                self.attack(bot, action[1], action[2])
+            else:
+                self.actions[bot] = {"type": action[0]}
+
+
+def launch_action(target, strength):
+    """
+    Returns the action tuple of a launch at opponent bot target
+    """
+    return ("launch", target, strength)
+
+
+def to_action_tuples(actions):
+    """
+    Converts a sequence of json action dicts to a tuple of action tuples
+    """
+    return tuple(
+        ("launch", action["target"], action["strength"]) if action["type"] == "launch" else (action["type"],)
+        for action in actions
+    )
+
+
+def _resolve_attacks(attacker_actions, attacker_bots, target_actions, target_bots):
+    # process_actions from server/game.py: returns the target healths and the
+    # attacker ammo after the attacker's actions
+    healths = [bot[0] + Controller.SHIELD_HEALTH if action[0] == "shield" else bot[0]
+               for bot, action in zip(target_bots, target_actions)]
+    ammo = []
+    for (health, bot_ammo), action in zip(attacker_bots, attacker_actions):
+        kind = action[0]
+        if kind == "none" or health <= 0:
+            pass
+        elif kind == "load":
+            bot_ammo += 1
+        elif kind == "launch":
+            target, strength = action[1], action[2]
+            if 0 <= strength <= bot_ammo and 0 <= target < Controller.NUM_BOTS and target_bots[target][0] != 0:
+                healths[target] = max(healths[target] - strength, 0)
+                bot_ammo -= strength
+        ammo.append(bot_ammo)
+    # shield health left over is lost
+    return [min(health, bot[0]) for health, bot in zip(healths, target_bots)], ammo
+
+
+@functools.lru_cache(maxsize=SIMULATION_CACHE_SIZE)
+def simulate_bots(my_bots, op_bots, my_actions, op_actions):
+    """
+    Returns the (my_bots, op_bots) tuples after a turn. The turn number does
+    not change the outcome, so it is left out of the cache key and positions
+    reached on different turns share their results.
+    """
+    op_healths, my_ammo = _resolve_attacks(my_actions, my_bots, op_actions, op_bots)
+    my_healths, op_ammo = _resolve_attacks(op_actions, op_bots, my_actions, my_bots)
+    # dead bots lose their ammo
+    return (
+        tuple((health, ammo if health else 0) for health, ammo in zip(my_healths, my_ammo)),
+        tuple((health, ammo if health else 0) for health, ammo in zip(op_healths, op_ammo)),
+    )
+
+
+@functools.lru_cache(maxsize=SIMULATION_CACHE_SIZE)
+def valid_actions(bots, op_bots, bot):
+    """
+    Returns the action tuples bots[bot] can take without an error
+    """
+    health, ammo = bots[bot]
+    if health <= 0:
+        return (NONE_ACTION,)
+    actions = [NONE_ACTION, LOAD_ACTION, SHIELD_ACTION]
+    for target, op_bot in enumerate(op_bots):
+        if op_bot[0] != 0:
+            actions.extend(("launch", target, strength) for strength in range(1, ammo + 1))
+    return tuple(actions)
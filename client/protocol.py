@@ -0,0 +1,160 @@
+"""
+Definitions shared by the client and the server: the gameplay constants and
+the wire encoding of messages. Both sides import this module, so the rules
+they apply and the messages they exchange cannot drift apart.
+
+The game_update and turn messages, which are sent every turn, have a compact
+binary encoding. It is an alternative to json, chosen at login:
+    { "type": "login", "user": "your username", "encoding": "binary" }
+The server confirms the encoding it will use in the login response. Other
+messages are always json. Binary messages are sent as binary websocket frames
+(bytes), so they are never confused with json messages (str).
+
+Layout (little endian):
+    header: message kind (1 byte), game id (16 byte uuid), turn (2 bytes)
+    game_update: for each of the player's bots then each opponent bot, its
+                 health (1 byte) and ammo (2 bytes); the actions of the
+                 player's bots then of the opponent bots, each a type code
+                 (1 byte, index in ACTION_TYPES), target (1 byte) and strength
+                 (2 bytes); then the player's error code per bot (1 byte, -1
+                 for no error)
+    turn: the action of each of the player's bots, laid out as above
+
+Values that do not fit, or that are not exactly ints (e.g. a float or bool
+strength), make the encoders return None; the message is then sent as json
+instead.
+"""
+import struct
+import uuid
+
+JSON, BINARY = "json", "binary"
+ENCODINGS = (JSON, BINARY)
+
+#Gameplay constants
+NUM_BOTS = 3
+INITIAL_HEALTH = 5
+SHIELD_HEALTH = 3
+MAX_TURNS = 250
+
+#Illegal action constants, sent as error codes in game updates
+INVALID_TARGET, DEAD_TARGET, DEAD_BOT_ACTION, NOT_ENOUGH_AMMO = 0, 1, 2, 3
+NO_ERROR = -1
+
+#Action type constants
+NONE, LOAD, LAUNCH, SHIELD = 0, 1, 2, 3
+ACTION_TYPES = ("none", "load", "launch", "shield")
+ACTION_CODES = {name: code for code, name in enumerate(ACTION_TYPES)}
+
+GAME_UPDATE, TURN = 1, 2
+HEADER = struct.Struct("<B16sH")
+BOTS = "BH" * 2 * NUM_BOTS
+ACTIONS = "Bbh" * NUM_BOTS
+GAME_UPDATE_MESSAGE = struct.Struct("<B16sH" + BOTS + ACTIONS * 2 + "b" * NUM_BOTS)
+TURN_MESSAGE = struct.Struct("<B16sH" + ACTIONS)
+
+
+def _action_fields(action, fields):
+    code = ACTION_CODES[action["type"]]
+    # the same checks as the server's json decoding: bool is a subclass of
+    # int, so compare exact types
+    target, strength = action.get("target", 0), action.get("strength", 0)
+    if type(target) is not int or type(strength) is not int:
+        raise TypeError("target and strength must be ints")
+    fields.append(code)
+    if code == LAUNCH:
+        fields.append(action["target"])
+        fields.append(action["strength"])
+    else:
+        fields.extend((0, 0))
+
+
+def _decode_actions(fields, start):
+    actions = []
+    for i in range(start, start + 3 * NUM_BOTS, 3):
+        code, target, strength = fields[i:i + 3]
+        if code == LAUNCH:
+            actions.append({"type": "launch", "target": target, "strength": strength})
+        else:
+            actions.append({"type": ACTION_TYPES[code]})
+    return actions
+
+
+def encode_game_update(game_id, turn, bots, op_bots, actions, op_actions, errors):
+    """
+    Returns the binary game_update message, or None if it cannot be encoded.
+    Arguments are as in the json message; errors is a list of
+    (error code, bot index) pairs.
+    """
+    try:
+        fields = [GAME_UPDATE, uuid.UUID(game_id).bytes, turn]
+        for bot in bots:
+            fields.extend(bot)
+        for bot in op_bots:
+            fields.extend(bot)
+        for action in actions:
+            _action_fields(action, fields)
+        for action in op_actions:
+            _action_fields(action, fields)
+        codes = [NO_ERROR] * NUM_BOTS
+        for code, bot in errors:
+            codes[bot] = code
+        fields.extend(codes)
+        return GAME_UPDATE_MESSAGE.pack(*fields)
+    except (KeyError, TypeError, ValueError, IndexError, struct.error):
+        return None
+
+
+def decode_game_update(message):
+    """
+    Returns the game_update message as the dict its json form decodes to,
+    or None if the message is not a binary game_update.
+    """
+    if len(message) != GAME_UPDATE_MESSAGE.size or message[0] != GAME_UPDATE:
+        return None
+    fields = GAME_UPDATE_MESSAGE.unpack(message)
+    bots = [list(fields[i:i + 2]) for i in range(3, 3 + 4 * NUM_BOTS, 2)]
+    actions_start = 3 + 4 * NUM_BOTS
+    errors_start = actions_start + 6 * NUM_BOTS
+    if any(fields[i] >= len(ACTION_TYPES) for i in range(actions_start, errors_start, 3)):
+        return None
+    return {
+        "type": "game_update",
+        "game_id": str(uuid.UUID(bytes=fields[1])),
+        "turn": fields[2],
+        "bots": bots[:NUM_BOTS],
+        "op_bots": bots[NUM_BOTS:],
+        "actions": _decode_actions(fields, actions_start),
+        "op_actions": _decode_actions(fields, actions_start + 3 * NUM_BOTS),
+        "errors": [[code, bot] for bot, code in enumerate(fields[errors_start:]) if code != NO_ERROR],
+    }
+
+
+def encode_turn(game_id, turn, actions):
+    """
+    Returns the binary turn message for a list of json actions (as set by
+    the Controller), or None if it cannot be encoded.
+    """
+    try:
+        if len(actions) != NUM_BOTS:
+            return None
+        fields = [TURN, uuid.UUID(game_id).bytes, turn]
+        for action in actions:
+            _action_fields(action, fields)
+        return TURN_MESSAGE.pack(*fields)
+    except (KeyError, TypeError, ValueError, struct.error):
+        return None
+
+
+def decode_turn(message):
+    """
+    Returns (game id, turn, actions) for a binary turn message, where actions
+    is a list of (type code, target, strength) tuples, one per bot.
+    Returns None if the message is not a valid binary turn.
+    """
+    if len(message) != TURN_MESSAGE.size or message[0] != TURN:
+        return None
+    fields = TURN_MESSAGE.unpack(message)
+    actions = [fields[i:i + 3] for i in range(3, 3 + 3 * NUM_BOTS, 3)]
+    if any(action[0] >= len(ACTION_TYPES) for action in actions):
+        return None
+    return str(uuid.UUID(bytes=fields[1])), fields[2], actions
@@ -0,0 +1,101 @@
+"""
+History of the game being played, kept by the client and handed to every
+Controller. Each turn appends one row in place to arrays allocated once per
+game, and the Controller gives out read-only memoryviews of them, so reading
+the whole history of a bot costs nothing however long the game is.
+"""
+import array
+from protocol import NUM_BOTS, MAX_TURNS, ACTION_TYPES, ACTION_CODES
+
+# one row per turn plus the initial state
+ROWS = MAX_TURNS + 1
+# values stored in the arrays (32 bit signed ints) are clamped to this range
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+
+# (player, field) of every array; player is "my" or "op"
+SERIES = tuple((player, field) for player in ("my", "op")
+               for field in ("health", "ammo", "action", "target", "strength"))
+
+
+def _int(value):
+    # opponents may send any number as a target or strength
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+    return INT_MIN if value < INT_MIN else INT_MAX if value > INT_MAX else value
+
+
+class TurnHistory:
+    """
+    Representation:
+    num_turns: number of turns recorded; rows 0 (the initial state) to
+               num_turns are filled
+    series: dictionary mapping (player, field) to an array of NUM_BOTS * ROWS
+            ints, bot major, so the turns of a bot are contiguous. Actions are
+            codes in ACTION_TYPES; the row of a turn holds the actions taken
+            on that turn and the state after it. Targets and strengths are 0
+            for actions other than launch.
+    counts: dictionary mapping player to an array of NUM_BOTS * len(ACTION_TYPES)
+            ints, the number of actions of each type taken by each bot
+    """
+
+    def __init__(self, bots, op_bots):
+        """
+        Starts the history of a game from the bots of the begin_game message.
+        """
+        self.num_turns = 0
+        self.series = {key: array.array("i", bytes(4 * NUM_BOTS * ROWS)) for key in SERIES}
+        self.counts = {player: array.array("i", bytes(4 * NUM_BOTS * len(ACTION_TYPES)))
+                       for player in ("my", "op")}
+        self._set_bots("my", 0, bots)
+        self._set_bots("op", 0, op_bots)
+
+    def _set_bots(self, player, row, bots):
+        health, ammo = self.series[player, "health"], self.series[player, "ammo"]
+        for bot, (bot_health, bot_ammo) in enumerate(bots):
+            health[bot * ROWS + row] = _int(bot_health)
+            ammo[bot * ROWS + row] = _int(bot_ammo)
+
+    def _set_actions(self, player, row, actions):
+        types = self.series[player, "action"]
+        targets = self.series[player, "target"]
+        strengths = self.series[player, "strength"]
+        counts = self.counts[player]
+        for bot, action in enumerate(actions):
+            code = ACTION_CODES.get(action.get("type"), 0)
+            types[bot * ROWS + row] = code
+            if code == ACTION_CODES["launch"]:
+                targets[bot * ROWS + row] = _int(action.get("target"))
+                strengths[bot * ROWS + row] = _int(action.get("strength"))
+            counts[bot * len(ACTION_TYPES) + code] += 1
+
+    def record_turn(self, turn, bots, op_bots, actions, op_actions):
+        """
+        Appends a turn from the fields of a game_update message. Turns past
+        MAX_TURNS and turns already recorded are ignored.
+        """
+        if not self.num_turns < turn <= MAX_TURNS:
+            return
+        self._set_bots("my", turn, bots)
+        self._set_bots("op", turn, op_bots)
+        self._set_actions("my", turn, actions)
+        self._set_actions("op", turn, op_actions)
+        self.num_turns = turn
+
+    def view(self, player, field, bot):
+        """
+        Returns a read-only memoryview of a field of a bot for turns 0 to
+        num_turns. The view is not copied and does not change when more turns
+        are recorded.
+        """
+        start = bot * ROWS
+        return memoryview(self.series[player, field])[start:start + self.num_turns + 1].toreadonly()
+
+    def action_counts(self, player, bot):
+        """
+        Returns a read-only memoryview of the number of actions of each type
+        (indexed by action code) taken by a bot.
+        """
+        start = bot * len(ACTION_TYPES)
+        return memoryview(self.counts[player])[start:start + len(ACTION_TYPES)].toreadonly()
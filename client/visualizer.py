@@ -1,14 +1,24 @@
+import bisect
 import curses
 from curses.textpad import rectangle
+import os
+import sys
 import time
 from controller import Controller
 import threading
 import asyncio
 import traceback
-from datetime import datetime
 
 # Delay between automatic updates in seconds
 AUTORUN_DELAY = 0.5
+# Most frames drawn per second, however fast keys are pressed
+MAX_FPS = 30
+# Longest wait for a key press in seconds. Commands submitted while waiting
+# are added when it ends, so new game states show up within this delay.
+INPUT_TIMEOUT = 0.1
+
+# Replay archives are read with the server's replay module
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "server")
 
 # Style constants
 BAR_CELL_WIDTH = 2
@@ -40,6 +50,55 @@ ASCII_BOTS = ["""
     """]
 
 
+class ReplayCommands:
+    """
+    Read-only list of visualizer commands for every game of a replay archive:
+    a "begin" command, one "update" command per turn and an "end" command per
+    game. Commands are made when accessed, reading the turn from the archive,
+    so archives of any size can be browsed without loading them.
+    """
+
+    def __init__(self, visualizer, reader):
+        self.visualizer = visualizer
+        self.reader = reader
+        # index of the first command of each game, then the total
+        self.starts = [0]
+        for game in range(len(reader)):
+            self.starts.append(self.starts[-1] + reader.num_turns(game) + 2)
+
+    def __len__(self):
+        return self.starts[-1]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        game = bisect.bisect_right(self.starts, index) - 1
+        turn = index - self.starts[game]
+        info = self.reader.game_info(game)
+        if turn == 0:
+            state, tag = {"type": "begin_game"}, "begin"
+        elif turn > info["num_turns"]:
+            state, tag = {"type": "game_over", "winner": info["winner"]}, "end"
+        else:
+            record = self.reader.turn(game, turn)
+            state = {
+                "type": "game_update",
+                "turn": turn,
+                "bots": record["p1_bots"],
+                "op_bots": record["p2_bots"],
+                "actions": record["p1_actions"],
+                "op_actions": record["p2_actions"],
+                "errors": record["p1_errors"],
+                "name": info["player1"],
+                "op_name": info["player2"],
+                "exceptions": "",
+            }
+            tag = "update"
+        return tag, lambda: self.visualizer._render_game_internal(state)
+
+
 class Visualizer:
     def __init__(self):
         self.scr = None  # Screen
@@ -47,10 +106,12 @@ class Visualizer:
         self.commands = []
         self.command_idx = 0
         self.autorun = True
-        self.last_autorun = datetime.now()
+        self.last_autorun = time.monotonic()
+        # whether the screen is out of date, and when it was last drawn
+        self.dirty = True
+        self.last_frame = 0.0
 
         threading.Thread(target=self.loop.run_forever).start()
-        self._update()
 
     def cleanup(self):
         self.loop.call_soon_threadsafe(self.loop.stop)
@@ -78,6 +139,24 @@ class Visualizer:
     def render_error(self, error):
         self._submit_command(lambda: self._render_error_internal(error), "error")
 
+    def open_replay(self, path):
+        """
+        Shows the games of a replay archive written by the server (see 
+        server/replay.py) instead of live games, with the same controls.
+
+        Args: path (str): The archive file
+        """
+        if SERVER_DIR not in sys.path:
+            sys.path.append(SERVER_DIR)
+        from replay import ReplayReader
+        reader = ReplayReader(path)
+
+        def show():
+            self.commands = ReplayCommands(self, reader)
+            self.command_idx = 0
+            self.dirty = True
+        self._run_task(show)
+
     def _render_game_internal(self, state):
         """
         Renders a current game state
@@ -85,7 +164,7 @@ class Visualizer:
         Args:
             state: Game state as defined in server/server.py
         """
-        self.scr.clear()
+        self.scr.erase()
 
         if(state["type"] == 'begin_game'):
             self._draw_log(
@@ -113,6 +192,11 @@ class Visualizer:
                 str(state),
                 curses.color_pair(LOG_TEXT) | curses.A_BOLD
             )
+            if state.get("compute_time") is not None:
+                self._draw_multiline_text(
+                    (5, 28),
+                    f"play_turn: {state['compute_time'] * 1000:.1f} ms"
+                )
             if state["exceptions"] != "":
                 self._draw_log(
                     (5, 42),
@@ -130,7 +214,7 @@ class Visualizer:
         self.scr.refresh()
 
     def _render_error_internal(self, message):
-        self.scr.clear()
+        self.scr.erase()
         self._draw_log(
             (5, 5), 
             message,
@@ -165,61 +249,91 @@ class Visualizer:
         # Reset if no tag was found
         self.command_idx = og_idx
 
-    def _update(self):
-        if self.scr:
-            input = self.scr.getch()
-
-            if self.command_idx > 0 and input == 97:  # a
-                self.command_idx -= 1
-            elif self.command_idx < len(self.commands) - 1 and input == 100:  # d
-                self.command_idx += 1
-            elif input == 32:  # space
-                self.autorun = not self.autorun
-            elif input == 115 and self.commands:  # s
-                # Seek to start of game which means 1 start tag if we are in the middle
-                # or zero if we are at the start
-                self._seek(
-                    "begin",
-                    0 if self.commands[self.command_idx][0] == "begin" else 1,
-                    False
-                )
-            elif input == 101 and self.commands:  # e
-                # Seek to end of game which means 1 end tag if we are in the middle
-                # or zero if we are at the end
-                self._seek(
-                    "end",
-                    0 if self.commands[self.command_idx][0] == "end" else 1,
-                    True
-                )
-            elif input == 110:  # n
-                self._seek("begin", 1, True)
-            elif input == 112 and self.commands:  # p
-                # Seek back to previous game, which means passing over 2 begin tags
-                # if we are in the middle of a game or 1 if we are exactly at the
-                # start
-                self._seek(
-                    "begin",
-                    1 if self.commands[self.command_idx][0] == "begin" else 2,
-                    False
-                )
+    def _input_timeout(self):
+        """
+        Returns how long to wait for a key press, in milliseconds: until the
+        next autorun step or allowed frame if one is due, INPUT_TIMEOUT otherwise.
+        """
+        now = time.monotonic()
+        timeout = INPUT_TIMEOUT
+        if self.dirty:
+            timeout = min(timeout, self.last_frame + 1 / MAX_FPS - now)
+        if self.autorun and self.command_idx < len(self.commands) - 1:
+            timeout = min(timeout, self.last_autorun + AUTORUN_DELAY - now)
+        return max(0, int(timeout * 1000))
 
-            if (self.autorun and
-                (datetime.now() - self.last_autorun).seconds >= AUTORUN_DELAY and
-                self.command_idx < len(self.commands) - 1):
-                self.command_idx += 1
+    def _update(self):
+        """
+        Waits for a key press, then redraws the screen if the displayed command
+        changed, at most MAX_FPS times a second. Runs on the visualizer's loop
+        and reschedules itself.
+        """
+        self.scr.timeout(self._input_timeout())
+        input = self.scr.getch()
+        command_idx = self.command_idx
+
+        if self.command_idx > 0 and input == 97:  # a
+            self.command_idx -= 1
+        elif self.command_idx < len(self.commands) - 1 and input == 100:  # d
+            self.command_idx += 1
+        elif input == 32:  # space
+            self.autorun = not self.autorun
+        elif input == 115 and self.commands:  # s
+            # Seek to start of game which means 1 start tag if we are in the middle
+            # or zero if we are at the start
+            self._seek(
+                "begin",
+                0 if self.commands[self.command_idx][0] == "begin" else 1,
+                False
+            )
+        elif input == 101 and self.commands:  # e
+            # Seek to end of game which means 1 end tag if we are in the middle
+            # or zero if we are at the end
+            self._seek(
+                "end",
+                0 if self.commands[self.command_idx][0] == "end" else 1,
+                True
+            )
+        elif input == 110:  # n
+            self._seek("begin", 1, True)
+        elif input == 112 and self.commands:  # p
+            # Seek back to previous game, which means passing over 2 begin tags
+            # if we are in the middle of a game or 1 if we are exactly at the
+            # start
+            self._seek(
+                "begin",
+                1 if self.commands[self.command_idx][0] == "begin" else 2,
+                False
+            )
 
+        now = time.monotonic()
+        if (self.autorun and
+            now - self.last_autorun >= AUTORUN_DELAY and
+            self.command_idx < len(self.commands) - 1):
+            self.command_idx += 1
+            self.last_autorun = now
+
+        # any key may change the info panel, and a resize needs a redraw
+        if input != -1 or self.command_idx != command_idx:
+            self.dirty = True
+        if self.dirty and now - self.last_frame >= 1 / MAX_FPS:
             if self.commands:
                 self.commands[self.command_idx][1]()
             else:
-                self.scr.clear()
+                self.scr.erase()
                 self._draw_info((0, 0))
                 self.scr.refresh()
+            self.dirty = False
+            self.last_frame = now
 
         self._run_task(self._update)
 
     def _submit_command(self, cmd, tag):
         def add():
             self.commands.append((tag, cmd))
+            # the first command replaces the empty screen
+            if len(self.commands) == 1:
+                self.dirty = True
         self._run_task(add)
 
     def _run_task(self, task, delay=False, *args):
@@ -401,9 +515,10 @@ class Visualizer:
         """
         curses.curs_set(0)
         self.scr = scr
-        curses.halfdelay(4)
         self._init_colors()
         self.scr.clear()
+        # input is only read once the screen exists
+        self._run_task(self._update)
 
         try:
             callback()
@@ -412,7 +527,15 @@ class Visualizer:
 
         self.cleanup()
 
-if __name__ == "__main__":
+if __name__ == "__main__" and len(sys.argv) > 1:
+    # python visualizer.py <replay archive>
+    vis = Visualizer()
+    vis.open_replay(sys.argv[1])
+    try:
+        vis.run(threading.Event().wait)
+    except KeyboardInterrupt:
+        print("Exiting...")
+elif __name__ == "__main__":
     vis = Visualizer()
 
     def execute():
@@ -4,46 +4,134 @@ import json
 from player import GameController
 import random
 import time
+import log
 
-async def autoscrim(players):
+logger = log.get_logger("autoscrim")
+
+# seconds a player that errored in a game waits before being paired again
+ERROR_COOLDOWN = 5
+
+async def game_wrapper(pair, replays=None):
+    """
+    Plays a game between a pair of players and returns the finished
+    GameController, or None if the game failed. The game is saved to the
+    ReplayWriter replays if given.
+    """
+    p1, p2 = pair
+    try:
+        game = GameController(p1, p2)
+        await game.play_game()
+        if replays is not None:
+            replays.write_match(game)
+        return game
+    except Exception:
+        logger.exception("error with %s %s", p1, p2)
+
+def random_pairs(pool):
     """
-    Runs autoscrims between all the players passed in.
-    Arguments:
-    players: a dictionary mapping player usernames (strings) to Player objects
+    Pairs the players of the list pool at random. Returns a list of 
+    (player, player) tuples; with an odd number of players, one is left out.
     """
-    if len(players) < 2:
-        print('not enough players to do autoscrims', len(players))
-        return
+    random.shuffle(pool)
+    return list(zip(pool[0::2], pool[1::2]))
 
-    num_players = len(players)
-    # number of games (ignoring one player if there are an odd # of players)
-    num_games = num_players // 2
-    is_even = num_players % 2 == 0
+class Matchmaker:
+    """
+    Continuously pairs idle players. A player enters the idle pool when they
+    log in or when their game ends, and the pool is paired as soon as possible,
+    so players never wait for other games to finish.
 
-    shuffled = list(players.values())
-    random.shuffle(shuffled)
+    Representation:
+    players: the server's dictionary mapping usernames to logged in Player objects
+    play: coroutine function that plays a game given a pair of players and 
+          returns the finished GameController (or an object with the same 
+          get_id, get_num_turns and get_results methods), or None on failure
+    idle: dictionary mapping usernames to Player objects waiting for a game
+    busy: set of usernames currently in a game started by the matchmaker
+    paused: if True, no new games are started (e.g. during a tournament)
+    results_store: ResultsStore that game results are recorded in, or None
+    ratings: Ratings updated after each game, or None
+    pair: function pairing a list of idle players, like random_pairs or 
+          Ratings.pair_players
+    """
 
-    player_set_1 = shuffled[:num_games]
-    player_set_2 = shuffled[num_games:]
+    def __init__(self, players, play=game_wrapper, results_store=None, ratings=None, pair=random_pairs):
+        self.players = players
+        self.play = play
+        self.results_store = results_store
+        self.ratings = ratings
+        self.pair = pair
+        self.idle = dict()
+        self.busy = set()
+        self.paused = False
+        self.games = set()
+        self.pairing_scheduled = False
 
-    games = [pair for pair in zip(player_set_1, player_set_2)]
+    def add(self, player):
+        """
+        Adds a player to the idle pool if they are still logged in.
+        """
+        if self.players.get(player.username) is not player or player.username in self.busy:
+            return
+        self.idle[player.username] = player
+        self.schedule_pairing()
 
-    # if odd, match the extra player with the first player in player_arr_1
-    if not is_even:
-        # extra player is located at player_set_2[-1]
-        games.append((player_set_1[0], player_set_2[-1]))
+    def remove(self, player):
+        """
+        Removes a player from the idle pool, e.g. when they disconnect.
+        """
+        if self.idle.get(player.username) is player:
+            del self.idle[player.username]
 
-    games_results = [game_wrapper(pair) for pair in games]
-    print("games to be played:", games)
-    await asyncio.gather(*games_results)
-    print('finished running all games', games_results)
-    
+    def pause(self):
+        self.paused = True
 
-async def game_wrapper(pair):
-    p1, p2 = pair
-    try:
-        game = GameController(p1, p2)
-        await game.play_game()
-        return game.get_results()
-    except Exception as e:
-        print('error with ', p1, p2)
\ No newline at end of file
+    def resume(self):
+        """
+        Resumes matchmaking, adding every logged in player that is not in a game.
+        """
+        self.paused = False
+        for player in list(self.players.values()):
+            self.add(player)
+
+    def schedule_pairing(self):
+        # pair once per event loop iteration, so players that become idle 
+        # at the same time are shuffled together instead of rematched
+        if not self.pairing_scheduled:
+            self.pairing_scheduled = True
+            asyncio.get_running_loop().call_soon(self.pair_idle_players)
+
+    def pair_idle_players(self):
+        self.pairing_scheduled = False
+        # players that stopped answering heartbeat pings stay idle until they 
+        # answer again
+        pool = [player for player in self.idle.values() if player.responsive]
+        if self.paused or len(pool) < 2:
+            return
+        # an odd player out stays idle until the next player becomes available
+        for p1, p2 in self.pair(pool):
+            for player in (p1, p2):
+                del self.idle[player.username]
+                self.busy.add(player.username)
+            task = asyncio.create_task(self.run_game(p1, p2))
+            self.games.add(task)
+            task.add_done_callback(self.games.discard)
+
+    async def run_game(self, p1, p2):
+        results = None
+        try:
+            match = await self.play((p1, p2))
+            results = match.get_results() if match is not None else None
+            if results and self.results_store is not None:
+                self.results_store.record_match(match)
+            if results and self.ratings is not None:
+                self.ratings.update(p1.username, p2.username, *results)
+        finally:
+            errored_players = results[1] if results and results[1] else ()
+            loop = asyncio.get_running_loop()
+            for player in (p1, p2):
+                self.busy.discard(player.username)
+                if player.username in errored_players:
+                    loop.call_later(ERROR_COOLDOWN, self.add, player)
+                else:
+                    self.add(player)
@@ -0,0 +1,173 @@
+import numpy as np
+from game import (NUM_BOTS, INITIAL_HEALTH, SHIELD_HEALTH, MAX_TURNS,
+                  TURN_OVER, P1_WIN, P2_WIN, TIE,
+                  INVALID_TARGET, DEAD_TARGET, DEAD_BOT_ACTION, NOT_ENOUGH_AMMO,
+                  NONE, LOAD, LAUNCH, SHIELD, decode_actions)
+
+#Error code stored for bots that did not error
+NO_ERROR = -1
+
+#Integer type of every health, ammo and action array. Ammo can never exceed
+#MAX_TURNS, so launch strengths and targets are clamped to just outside their
+#legal range before narrowing, which keeps every illegal value illegal.
+DTYPE = np.int16
+MAX_STRENGTH = MAX_TURNS + 1
+
+
+def _narrow(values, low, high):
+    values = np.asarray(values)
+    if values.dtype == DTYPE:
+        return values
+    return np.clip(values, low, high).astype(DTYPE)
+
+
+def encode_actions(p1_actions, p2_actions):
+    """
+    Encodes one turn of actions (as accepted by Game.submit_turn) for
+    a single game into (types, targets, strengths) arrays of shape (2, NUM_BOTS).
+    Stack these along a last axis to build the arrays taken by BatchGame.submit_turn.
+    """
+    types = np.zeros((2, NUM_BOTS), dtype=DTYPE)
+    targets = np.zeros((2, NUM_BOTS), dtype=DTYPE)
+    strengths = np.zeros((2, NUM_BOTS), dtype=DTYPE)
+    for player, actions in enumerate((p1_actions, p2_actions)):
+        for bot_id, action in enumerate(decode_actions(actions)):
+            types[player, bot_id] = action.type
+            if action.type == LAUNCH:
+                targets[player, bot_id] = min(max(action.target, -1), NUM_BOTS)
+                strengths[player, bot_id] = min(max(action.strength, -1), MAX_STRENGTH)
+    return types, targets, strengths
+
+
+def decode_errors(errors):
+    """
+    Converts one game's (2, NUM_BOTS) error array back into the
+    (p1_errors, p2_errors) lists of (error code, bot id) returned by Game.submit_turn.
+    """
+    return tuple(
+        [(int(code), bot_id) for bot_id, code in enumerate(player_errors) if code != NO_ERROR]
+        for player_errors in errors
+    )
+
+
+class BatchGame:
+    """
+    Holds N independent games as NumPy arrays and resolves a turn of every
+    game in one vectorized call. The rules are the same as Game.submit_turn.
+
+    Representation (the game axis is last so every operation runs over
+    contiguous rows of N games):
+    health: int16 array (2, NUM_BOTS, N), axis 0 is (player 1, player 2)
+    ammo: int16 array (2, NUM_BOTS, N)
+    status: int8 array (N,) of game status constants
+    round: int16 array (N,)
+
+    Actions are passed as three arrays of shape (2, NUM_BOTS, N): the action
+    code (NONE/LOAD/LAUNCH/SHIELD), the launch target and the launch strength.
+    Target and strength are ignored for actions other than LAUNCH.
+    """
+
+    def __init__(self, num_games):
+        self.num_games = num_games
+        self.health = np.full((2, NUM_BOTS, num_games), INITIAL_HEALTH, dtype=DTYPE)
+        self.ammo = np.zeros((2, NUM_BOTS, num_games), dtype=DTYPE)
+        self.status = np.full(num_games, TURN_OVER, dtype=np.int8)
+        self.round = np.zeros(num_games, dtype=DTYPE)
+
+    def submit_turn(self, types, targets, strengths):
+        """
+        Resolves one turn for every game that is not over yet. Finished games
+        are left untouched.
+
+        Returns an int8 array (2, NUM_BOTS, N) of error codes, NO_ERROR for bots
+        whose action was legal.
+        """
+        types = np.asarray(types, dtype=DTYPE)
+        targets = _narrow(targets, -1, NUM_BOTS)
+        strengths = _narrow(strengths, -1, MAX_STRENGTH)
+
+        active = ~self.is_game_over()
+        health, ammo = self.health, self.ammo
+        # the opponent's view of every array is the same array with the player axis flipped
+        op_health = health[::-1]
+        # masks are applied by multiplication, which is much faster than np.where
+        # or boolean indexing on scattered masks
+        on_target = [targets == target for target in range(NUM_BOTS)]
+
+        # errors are assigned in the same precedence as process_actions
+        dead_action = (types != NONE) & (health <= 0)
+        launch = (types == LAUNCH) & ~dead_action
+        bad_ammo = launch & ((strengths > ammo) | (strengths < 0))
+        launch &= ~bad_ammo
+        bad_target = launch & ((targets < 0) | (targets >= NUM_BOTS))
+        launch &= ~bad_target
+        target_health = on_target[0] * op_health[:, 0, None]
+        for target in range(1, NUM_BOTS):
+            target_health += on_target[target] * op_health[:, target, None]
+        dead_target = launch & (target_health == 0)
+        launch &= ~dead_target
+
+        # the error masks are disjoint, so each one can be added on top of NO_ERROR
+        errors = np.full(health.shape, NO_ERROR, dtype=np.int8)
+        for code, mask in ((DEAD_BOT_ACTION, dead_action), (NOT_ENOUGH_AMMO, bad_ammo),
+                           (INVALID_TARGET, bad_target), (DEAD_TARGET, dead_target)):
+            errors += mask.view(np.int8) * np.int8(code - NO_ERROR)
+
+        # damage dealt to each opponent bot, summed over the attacking bots
+        launched = strengths * launch
+        damage = np.empty(health.shape, dtype=DTYPE)
+        for target in range(NUM_BOTS):
+            hits = launched * on_target[target]
+            damage[:, target] = hits[:, 0]
+            for bot_id in range(1, NUM_BOTS):
+                damage[:, target] += hits[:, bot_id]
+
+        # shield health absorbs damage first and never carries over
+        new_health = health + (types == SHIELD) * DTYPE(SHIELD_HEALTH)
+        new_health -= damage[::-1]
+        np.maximum(new_health, DTYPE(0), out=new_health)
+        np.minimum(new_health, health, out=new_health)
+
+        new_ammo = ammo + ((types == LOAD) & ~dead_action)
+        new_ammo -= launched
+        new_ammo *= new_health > 0
+
+        if active.all():
+            self.health, self.ammo = new_health, new_ammo
+        else:
+            self.health = np.where(active, new_health, health)
+            self.ammo = np.where(active, new_ammo, ammo)
+            errors[:, :, ~active] = NO_ERROR
+        self.round += active
+        self.check_victory(active)
+        return errors
+
+    def check_victory(self, active=None):
+        """
+        Updates the status of every active game, following Game.check_victory.
+        """
+        if active is None:
+            active = ~self.is_game_over()
+        p1_dead = ~self.health[0].any(axis=0)
+        p2_dead = ~self.health[1].any(axis=0)
+        status = np.full(self.num_games, TURN_OVER, dtype=np.int8)
+        status[p2_dead] = P1_WIN
+        status[p1_dead] = P2_WIN
+        status[(p1_dead & p2_dead) | (self.round >= MAX_TURNS)] = TIE
+        self.status = np.where(active, status, self.status)
+
+    def is_game_over(self):
+        """
+        Returns a boolean array marking the games that have ended.
+        """
+        return (self.status == P1_WIN) | (self.status == P2_WIN) | (self.status == TIE)
+
+    def get_bots(self, game_id):
+        """
+        Returns (p1_bots, p2_bots) of a single game in the [[health, ammo], ...]
+        format used by Game.
+        """
+        return tuple(
+            [[int(h), int(a)] for h, a in zip(self.health[player, :, game_id], self.ammo[player, :, game_id])]
+            for player in range(2)
+        )
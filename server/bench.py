@@ -0,0 +1,265 @@
+"""
+Benchmarks for the server hot paths.
+
+Run from the server directory:
+    python bench.py --output bench_results.json
+    python bench.py --compare bench_results.json
+
+Every benchmark reports ops/sec and p50/p99 latency per op. Allocation figures
+come from tracemalloc on a separate, smaller run: alloc_bytes is the peak memory
+allocated while one op runs and retained_blocks the memory blocks still alive
+after it (non-zero means the op leaks or grows a structure).
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from game import Game, process_actions, decode_actions, MAX_TURNS
+from history import GameHistory
+from player import Player, GameController
+import numpy as np
+from batch_game import BatchGame, encode_actions
+
+
+P1_ACTIONS = [{"type": "load"}, {"type": "launch", "target": 1, "strength": 1}, {"type": "shield"}]
+P2_ACTIONS = [{"type": "shield"}, {"type": "load"}, {"type": "launch", "target": 0, "strength": 2}]
+
+TURN_MESSAGE = json.dumps({"type": "turn", "game_id": "bench", "turn": 1, "actions": P1_ACTIONS})
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def measure(op, iterations, alloc_iterations=None):
+    """
+    Runs op iterations times. Returns a dict of timing and allocation results.
+    """
+    alloc_iterations = alloc_iterations or max(1, iterations // 20)
+    timings = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for _ in range(iterations):
+        op_start = clock()
+        op()
+        timings.append(clock() - op_start)
+    total = clock() - start
+    timings.sort()
+
+    tracemalloc.start()
+    peak_bytes = 0
+    before = tracemalloc.take_snapshot()
+    for _ in range(alloc_iterations):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        op()
+        peak_bytes += tracemalloc.get_traced_memory()[1] - current
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+
+    return {
+        "ops": iterations,
+        "ops_per_sec": iterations / (total / 1e9),
+        "p50_us": percentile(timings, 0.5) / 1e3,
+        "p99_us": percentile(timings, 0.99) / 1e3,
+        "alloc_bytes": peak_bytes / alloc_iterations,
+        "retained_blocks": retained / alloc_iterations,
+    }
+
+
+def bench_process_actions(iterations):
+    p1_actions, p2_actions = decode_actions(P1_ACTIONS), decode_actions(P2_ACTIONS)
+    game = Game()
+
+    def op():
+        process_actions(p1_actions, game.p1_bots, p2_actions, game.p2_bots)
+        # keep ammo from growing without bound
+        for bot in game.p1_bots:
+            bot[1] = 1
+    return measure(op, iterations)
+
+
+def bench_submit_turn(iterations):
+    p1_actions, p2_actions = decode_actions(P1_ACTIONS), decode_actions(P2_ACTIONS)
+    game = Game()
+
+    def op():
+        nonlocal game
+        if game.is_game_over():
+            game = Game()
+        game.submit_turn(p1_actions, p2_actions)
+    return measure(op, iterations)
+
+
+# games resolved by each BatchGame.submit_turn call
+BATCH_GAMES = 10000
+
+
+def bench_batch_submit_turn(iterations):
+    # the same turn as game_submit_turn in every game; the action arrays are
+    # built once, outside the timed op
+    types, targets, strengths = (np.ascontiguousarray(np.repeat(array[:, :, None], BATCH_GAMES, axis=2))
+                                 for array in encode_actions(P1_ACTIONS, P2_ACTIONS))
+    batch = BatchGame(BATCH_GAMES)
+
+    def op():
+        nonlocal batch
+        if batch.is_game_over().all():
+            batch = BatchGame(BATCH_GAMES)
+        batch.submit_turn(types, targets, strengths)
+    result = measure(op, iterations)
+    result["game_turns_per_sec"] = result["ops_per_sec"] * BATCH_GAMES
+    return result
+
+
+def bench_parse_turn_message(iterations):
+    player = Player(None, "bench")
+    return measure(lambda: player.parse_turn_message("bench", TURN_MESSAGE), iterations)
+
+
+def bench_dumps(iterations):
+    game = Game()
+    game.submit_turn(P1_ACTIONS, P2_ACTIONS)
+    return measure(game.dumps, iterations)
+
+
+def bench_history_record(iterations):
+    p1_actions, p2_actions = decode_actions(P1_ACTIONS), decode_actions(P2_ACTIONS)
+    history = GameHistory(Game())
+
+    def op():
+        nonlocal history
+        if history.num_turns >= MAX_TURNS:
+            history = GameHistory(Game())
+        history.record(p1_actions, p2_actions)
+    # each game's buffer is allocated as it grows, so measure allocations over a full game
+    return measure(op, iterations, alloc_iterations=MAX_TURNS)
+
+
+def bench_history_snapshots(iterations):
+    p1_actions, p2_actions = decode_actions(P1_ACTIONS), decode_actions(P2_ACTIONS)
+    game = Game()
+    history = GameHistory(game)
+    while not game.is_game_over():
+        game.submit_turn(p1_actions, p2_actions)
+        history.record(p1_actions, p2_actions)
+    return measure(history.snapshots, iterations)
+
+
+class FakeWebsocket:
+    """
+    In-memory websocket that answers every begin_game and game_update message
+    with the same turn, so a game lasts until MAX_TURNS.
+    """
+
+    def __init__(self, actions):
+        self.actions = actions
+        self.turn_message = None
+        self.inbox = asyncio.Queue()
+
+    async def send(self, message):
+        # only the begin message is decoded, to learn the game id
+        if message.startswith('{"type": "begin_game"'):
+            game_id = json.loads(message)["game_id"]
+            self.turn_message = json.dumps({"type": "turn", "game_id": game_id, "actions": self.actions})
+        elif not message.startswith('{"type": "game_update"'):
+            return
+        self.inbox.put_nowait(self.turn_message)
+
+    async def recv(self):
+        return await self.inbox.get()
+
+
+def bench_play_game(iterations):
+    # both bots survive (one side only shields and loads), so every game runs MAX_TURNS turns
+    loaders = [{"type": "load"}, {"type": "load"}, {"type": "shield"}]
+    shielders = [{"type": "shield"}, {"type": "shield"}, {"type": "load"}]
+    loop = asyncio.new_event_loop()
+
+    def op():
+        player1 = Player(FakeWebsocket(loaders), "bench1")
+        player2 = Player(FakeWebsocket(shielders), "bench2")
+        loop.run_until_complete(GameController(player1, player2).play_game())
+        player1.close()
+        player2.close()
+
+    try:
+        result = measure(op, iterations, alloc_iterations=max(1, iterations // 10))
+    finally:
+        # let the cancelled writer tasks of the last game finish
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+    result["turns_per_sec"] = result["ops_per_sec"] * MAX_TURNS
+    result["alloc_bytes_per_turn"] = result["alloc_bytes"] / MAX_TURNS
+    return result
+
+
+BENCHMARKS = {
+    "process_actions": (bench_process_actions, 200000),
+    "game_submit_turn": (bench_submit_turn, 100000),
+    "batch_submit_turn": (bench_batch_submit_turn, 2000),
+    "parse_turn_message": (bench_parse_turn_message, 100000),
+    "game_dumps": (bench_dumps, 100000),
+    "history_record": (bench_history_record, 100000),
+    "history_snapshots": (bench_history_snapshots, 200),
+    "play_game": (bench_play_game, 20),
+}
+
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<20}{'ops/sec':>14}{'p50 us':>10}{'p99 us':>10}{'alloc B':>10}{'retained':>10}")
+    for name, result in results.items():
+        line = (f"{name:<20}{result['ops_per_sec']:>14,.0f}{result['p50_us']:>10.2f}{result['p99_us']:>10.2f}"
+                f"{result['alloc_bytes']:>10.0f}{result['retained_blocks']:>10.2f}")
+        if baseline and name in baseline:
+            line += f"  {result['ops_per_sec'] / baseline[name]['ops_per_sec']:.2f}x"
+        print(line)
+    if "batch_submit_turn" in results:
+        batch = results["batch_submit_turn"]
+        line = f"batch_submit_turn: {batch['game_turns_per_sec']:,.0f} game turns/sec over {BATCH_GAMES} games"
+        if "game_submit_turn" in results:
+            line += f", {batch['game_turns_per_sec'] / results['game_submit_turn']['ops_per_sec']:.0f}x game_submit_turn"
+        print(line)
+    if "play_game" in results:
+        play_game = results["play_game"]
+        print(f"play_game: {play_game['ops_per_sec']:.1f} games/sec, {play_game['turns_per_sec']:,.0f} turns/sec, "
+              f"{play_game['alloc_bytes_per_turn']:.0f} bytes allocated per turn")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the server hot paths.")
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the number of iterations")
+    parser.add_argument("--output", default=None, help="save results as json")
+    parser.add_argument("--compare", default=None, help="json results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.benchmarks or BENCHMARKS:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+        bench, iterations = BENCHMARKS[name]
+        results[name] = bench(max(1, int(iterations * args.scale)))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": sys.version,
+                "platform": platform.platform(),
+                "time": time.time(),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
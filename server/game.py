@@ -1,16 +1,69 @@
 
 import json
-#Gameplay constants
-NUM_BOTS = 3
-INITIAL_HEALTH = 5
-SHIELD_HEALTH = 3
-MAX_TURNS = 250
+import os
+import sys
+
+# The gameplay constants and the wire encoding are defined once, in
+# client/protocol.py, which competitors are given with the client. Every
+# server module imports game first, so this is the only place the server
+# looks into the client directory.
+CLIENT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "client"))
+if CLIENT_DIR not in sys.path:
+    sys.path.append(CLIENT_DIR)
+from protocol import (NUM_BOTS, INITIAL_HEALTH, SHIELD_HEALTH, MAX_TURNS,
+                      INVALID_TARGET, DEAD_TARGET, DEAD_BOT_ACTION, NOT_ENOUGH_AMMO,
+                      NONE, LOAD, LAUNCH, SHIELD, ACTION_TYPES, ACTION_CODES)
 
 #Game status constants
 TURN_OVER, P1_PLAYED, P2_PLAYED, P1_WIN, P2_WIN, TIE = 0, 1, 2, 3, 4, 5
 
-#Illegal action constants
-INVALID_TARGET, DEAD_TARGET, DEAD_BOT_ACTION, NOT_ENOUGH_AMMO = 0, 1, 2, 3
+
+class Action:
+    """
+    Integer-coded action of a single bot. Actions are decoded from the json 
+    wire format ({"type": "none/load/launch/shield", "target": number, "strength": number})
+    once when a turn message is accepted, so the engine never compares strings.
+    target and strength are only meaningful for LAUNCH actions.
+    """
+    __slots__ = ("type", "target", "strength")
+
+    def __init__(self, type=NONE, target=0, strength=0):
+        self.type = type
+        self.target = target
+        self.strength = strength
+
+    @classmethod
+    def from_json(cls, action):
+        """
+        Decodes a json action dict. Raises KeyError for unknown action types 
+        and for launch actions missing a target or strength.
+        """
+        code = ACTION_CODES[action["type"]]
+        if code == LAUNCH:
+            return cls(code, action["target"], action["strength"])
+        return cls(code)
+
+    def to_json(self):
+        """
+        Returns the json wire format of this action.
+        """
+        if self.type == LAUNCH:
+            return {"type": "launch", "target": self.target, "strength": self.strength}
+        return {"type": ACTION_TYPES[self.type]}
+
+    def __eq__(self, other):
+        return (isinstance(other, Action) and self.type == other.type
+                and self.target == other.target and self.strength == other.strength)
+
+    def __repr__(self):
+        return f"Action({self.to_json()})"
+
+
+def decode_actions(actions):
+    """
+    Returns a list of Actions, decoding json action dicts if needed.
+    """
+    return [action if isinstance(action, Action) else Action.from_json(action) for action in actions]
 
 
 
@@ -19,15 +72,15 @@ def process_actions(attacker_actions, attacker_bots, target_actions, target_bots
 
         #Tempoararily add shield health to all shielded bots
         for i, action in enumerate(target_actions): 
-            if action["type"] == "shield": new_target_healths[i] += SHIELD_HEALTH
+            if action.type == SHIELD: new_target_healths[i] += SHIELD_HEALTH
 
         errors = []
         for bot_id, action in enumerate(attacker_actions):
             bot = attacker_bots[bot_id]
-            if action["type"] != "none" and bot[0] <= 0: errors.append((DEAD_BOT_ACTION, bot_id))
-            elif action["type"] == "load": bot[1] += 1
-            elif action["type"] == "launch":
-                target, strength = action["target"], action["strength"]
+            if action.type != NONE and bot[0] <= 0: errors.append((DEAD_BOT_ACTION, bot_id))
+            elif action.type == LOAD: bot[1] += 1
+            elif action.type == LAUNCH:
+                target, strength = action.target, action.strength
                 if strength > bot[1] or strength < 0: errors.append((NOT_ENOUGH_AMMO, bot_id))
                 elif not 0 <= target < NUM_BOTS: errors.append((INVALID_TARGET, bot_id))
                 elif target_bots[target][0] == 0: errors.append((DEAD_TARGET, bot_id))
@@ -80,8 +133,14 @@ class Game:
             self.status = P1_WIN
     
     def submit_turn(self, p1_actions, p2_actions):
+        """
+        Steps the game by one round. Actions are lists of Action objects, one per
+        bot; json action dicts are also accepted and decoded first.
+        """
         assert len(p1_actions) == NUM_BOTS
         assert len(p2_actions) == NUM_BOTS
+        p1_actions = decode_actions(p1_actions)
+        p2_actions = decode_actions(p2_actions)
 
         # process game round
         p1_errors, p2_errors = self.process_turn(p1_actions, p2_actions)
@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from local_match import LocalPlayer
+from player import GameController
+from tournament_runner import rank_sort
+
+# Competitor classes already loaded in this process, keyed by file path
+_competitors = {}
+
+
+def load_competitor(path):
+    """
+    Loads the Competitor class defined in a bot file, like client/competitor.py.
+    Each file is loaded as its own module, so several bots can coexist.
+    """
+    path = os.path.abspath(path)
+    if path not in _competitors:
+        module_name = f"gauntlet_bot_{len(_competitors)}"
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _competitors[path] = module.Competitor
+    return _competitors[path]
+
+
+def bot_name(path):
+    """
+    Returns the display name of a bot file.
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def new_stats():
+    return {"games": 0, "wins": 0, "losses": 0, "ties": 0, "errors": 0,
+            "exceptions": 0, "op_exceptions": 0, "turns": 0}
+
+
+def add_stats(total, stats):
+    for key, value in stats.items():
+        total[key] += value
+
+
+async def _play_games(path1, path2, num_games, first_game):
+    competitor1, competitor2 = load_competitor(path1), load_competitor(path2)
+    stats = new_stats()
+    for game_num in range(first_game, first_game + num_games):
+        # alternate seats so neither bot always plays as player 1
+        bot1 = LocalPlayer(competitor1(), "bot1")
+        bot2 = LocalPlayer(competitor2(), "bot2")
+        if game_num % 2 == 0:
+            match = GameController(bot1, bot2)
+        else:
+            match = GameController(bot2, bot1)
+        await match.play_game()
+
+        winner, errored_players = match.get_results()
+        stats["games"] += 1
+        stats["turns"] += match.game.round
+        stats["exceptions"] += bot1.exceptions
+        stats["op_exceptions"] += bot2.exceptions
+        if errored_players:
+            stats["errors"] += 1
+        if winner == "bot1":
+            stats["wins"] += 1
+        elif winner == "bot2":
+            stats["losses"] += 1
+        else:
+            stats["ties"] += 1
+    return stats
+
+
+def play_pairing(path1, path2, num_games, first_game=0):
+    """
+    Plays num_games between the bots in two files. Runs in a worker process.
+    Returns a stats dict from the point of view of the first bot.
+    """
+    return asyncio.run(_play_games(path1, path2, num_games, first_game))
+
+
+def _silence_worker():
+    # bots may print on every turn; keep worker output off the terminal
+    sys.stdout = open(os.devnull, "w")
+
+
+def run_gauntlet(paths, games_per_pairing, workers=None, chunk_size=None, on_result=None):
+    """
+    Plays every pair of bot files against each other games_per_pairing times,
+    spreading the games over a pool of worker processes (one per core by default).
+
+    Pairings are split into chunks of chunk_size games so the work stays balanced
+    across cores. on_result(name1, name2, stats, matrix) is called in the parent
+    process as each chunk finishes, with the partial results so far.
+
+    Returns the results matrix: a dict mapping (name1, name2) to a stats dict
+    from the point of view of name1. Both orientations are present.
+    """
+    workers = workers or os.cpu_count()
+    names = [bot_name(path) for path in paths]
+    pairings = list(itertools.combinations(range(len(paths)), 2))
+    if chunk_size is None:
+        # aim for several chunks per worker so slow pairings don't leave cores idle
+        total_games = games_per_pairing * len(pairings)
+        chunk_size = max(1, min(games_per_pairing, total_games // (workers * 8)))
+
+    matrix = {}
+    for i, j in pairings:
+        matrix[(names[i], names[j])] = new_stats()
+        matrix[(names[j], names[i])] = new_stats()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_silence_worker) as executor:
+        futures = {}
+        for i, j in pairings:
+            for first_game in range(0, games_per_pairing, chunk_size):
+                num_games = min(chunk_size, games_per_pairing - first_game)
+                future = executor.submit(play_pairing, paths[i], paths[j], num_games, first_game)
+                futures[future] = (i, j)
+
+        for future in as_completed(futures):
+            i, j = futures[future]
+            stats = future.result()
+            add_stats(matrix[(names[i], names[j])], stats)
+            # the opponent's view of the same games
+            mirrored = dict(stats, wins=stats["losses"], losses=stats["wins"],
+                            exceptions=stats["op_exceptions"], op_exceptions=stats["exceptions"])
+            add_stats(matrix[(names[j], names[i])], mirrored)
+            if on_result:
+                on_result(names[i], names[j], stats, matrix)
+    return matrix
+
+
+def rank_gauntlet(matrix):
+    """
+    Ranks bots with tournament_runner.rank_sort. Returns a list of names.
+    """
+    rankings = {}
+    for (name, _), stats in matrix.items():
+        ranking = rankings.setdefault(name, {"played": 0, "won": 0, "lost": 0, "tied": 0})
+        ranking["played"] += stats["games"]
+        ranking["won"] += stats["wins"]
+        ranking["lost"] += stats["losses"]
+        ranking["tied"] += stats["ties"]
+    return rank_sort({name: ranking for name, ranking in rankings.items() if ranking["played"]})
+
+
+def print_progress(name1, name2, stats, matrix):
+    pairing = matrix[(name1, name2)]
+    print(f"{name1} vs {name2}: +{stats['games']} games, "
+          f"{pairing['wins']}-{pairing['losses']}-{pairing['ties']} after {pairing['games']}")
+
+
+def print_matrix(names, matrix):
+    """
+    Prints the win rate of each row bot against each column bot, followed by
+    errors and average game length per bot.
+    """
+    width = max(len(name) for name in names) + 2
+    print("win rate".ljust(width) + "".join(name[:8].rjust(9) for name in names))
+    for row in names:
+        cells = ""
+        for column in names:
+            stats = matrix.get((row, column))
+            cells += (f"{stats['wins'] / stats['games']:9.3f}" if stats and stats["games"] else " " * 8 + "-")
+        print(row.ljust(width) + cells)
+    print()
+    for name in names:
+        total = new_stats()
+        for (row, _), stats in matrix.items():
+            if row == name:
+                add_stats(total, stats)
+        avg_turns = total["turns"] / total["games"] if total["games"] else 0
+        print(f"{name}: {total['wins']}-{total['losses']}-{total['ties']}, "
+              f"{total['errors']} errored games, {total['exceptions']} exceptions, "
+              f"{avg_turns:.1f} turns/game")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play every pair of bots against each other.")
+    parser.add_argument("bots", nargs="+", help="files defining a Competitor class")
+    parser.add_argument("--games", type=int, default=100, help="games per pairing")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--chunk", type=int, default=None, help="games per task")
+    parser.add_argument("--output", default=None, help="write the results matrix to this json file")
+    args = parser.parse_args()
+
+    if len({bot_name(path) for path in args.bots}) != len(args.bots):
+        parser.error("bot file names must be unique")
+
+    matrix = run_gauntlet(args.bots, args.games, args.workers, args.chunk, print_progress)
+    names = rank_gauntlet(matrix)
+    print()
+    print_matrix(names, matrix)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "ranking": names,
+                "matrix": {f"{name1} vs {name2}": stats for (name1, name2), stats in matrix.items()},
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
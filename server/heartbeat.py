@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+# seconds between two pings of the same player
+HEARTBEAT_INTERVAL = 5
+# number of slots the interval is divided into; players are spread over them
+HEARTBEAT_SLOTS = 50
+# a player whose ping has been unanswered this long is unresponsive
+PONG_TIMEOUT = 10
+# weight of the newest sample in the smoothed round trip time
+RTT_SMOOTHING = 0.2
+
+
+class HeartbeatScheduler:
+    """
+    Pings every connected player from a single task, using a timing wheel:
+    each player is assigned one of HEARTBEAT_SLOTS slots, and every
+    HEARTBEAT_INTERVAL / HEARTBEAT_SLOTS seconds the players of the next slot
+    are pinged, so pings are staggered instead of sent in bursts.
+
+    Each Player gets its round trip time measured (player.rtt, smoothed in
+    player.avg_rtt) and is marked unresponsive (player.responsive = False) when
+    a ping stays unanswered for PONG_TIMEOUT seconds.
+
+    Representation:
+    wheel: list of sets of players, one per slot
+    slots: dictionary mapping players to their slot index
+    on_responsive: called with a player when they answer a ping after having
+                   been unresponsive
+    on_unresponsive: called with a player when they are marked unresponsive
+    pings: tasks sending pings
+    """
+
+    def __init__(self, on_responsive=None, on_unresponsive=None, interval=HEARTBEAT_INTERVAL,
+                 num_slots=HEARTBEAT_SLOTS):
+        self.on_responsive = on_responsive
+        self.on_unresponsive = on_unresponsive
+        self.interval = interval
+        self.wheel = [set() for _ in range(num_slots)]
+        self.slots = dict()
+        self.position = 0
+        self.task = None
+        self.pings = set()
+
+    def add(self, player):
+        """
+        Starts pinging a player. Starts the scheduler task if needed.
+        """
+        # put the player in the least loaded slot to keep the pings evenly spread
+        slot = min(range(len(self.wheel)), key=lambda i: len(self.wheel[i]))
+        self.wheel[slot].add(player)
+        self.slots[player] = slot
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def remove(self, player):
+        slot = self.slots.pop(player, None)
+        if slot is not None:
+            self.wheel[slot].discard(player)
+
+    async def run(self):
+        tick = self.interval / len(self.wheel)
+        next_tick = time.monotonic()
+        while True:
+            for player in list(self.wheel[self.position]):
+                self.check(player)
+            self.position = (self.position + 1) % len(self.wheel)
+            next_tick += tick
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
+
+    def check(self, player):
+        """
+        Sends a ping to the player, or marks them unresponsive if their last ping
+        is still unanswered after PONG_TIMEOUT.
+        """
+        if player.ping_sent is not None:
+            if time.monotonic() - player.ping_sent > PONG_TIMEOUT and player.responsive:
+                player.responsive = False
+                if self.on_unresponsive:
+                    self.on_unresponsive(player)
+            return
+        player.ping_sent = time.monotonic()
+        ping = asyncio.create_task(self.ping(player))
+        self.pings.add(ping)
+        ping.add_done_callback(self.pings.discard)
+
+    async def ping(self, player):
+        try:
+            pong_waiter = await player.websocket.ping()
+        except Exception:
+            # the connection handler removes closed connections
+            return
+        sent = player.ping_sent
+        pong_waiter.add_done_callback(lambda future: self.pong(player, sent, future))
+
+    def pong(self, player, sent, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        player.rtt = time.monotonic() - sent
+        if player.avg_rtt is None:
+            player.avg_rtt = player.rtt
+        else:
+            player.avg_rtt += RTT_SMOOTHING * (player.rtt - player.avg_rtt)
+        player.ping_sent = None
+        if not player.responsive:
+            player.responsive = True
+            if self.on_responsive:
+                self.on_responsive(player)
@@ -0,0 +1,143 @@
+import copy
+import json
+from game import Game, Action, NUM_BOTS, LAUNCH
+
+# one bit per bot (player 1 bots first) marks an action that changed since last turn
+assert 2 * NUM_BOTS <= 8
+
+
+def _write_varint(buffer, value):
+    """
+    Appends a zigzag varint encoding of any python int to buffer.
+    """
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(buffer, pos):
+    """
+    Reads a zigzag varint from buffer at pos. Returns (value, new position).
+    """
+    value, shift = 0, 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            break
+    return (value >> 1 if value % 2 == 0 else -(value >> 1) - 1), pos
+
+
+class GameHistory:
+    """
+    Records a game as its initial state plus a packed binary buffer of
+    per-turn action deltas.
+
+    Each turn is stored as one byte whose bits mark the bots whose action
+    changed since the previous turn, followed by the changed actions (a type
+    byte, plus varint target and strength for launches). Errors and game states
+    are not stored: the engine is deterministic, so snapshots() rebuilds them
+    by replaying the actions from the initial state.
+    """
+
+    def __init__(self, game):
+        self.initial_p1_bots = copy.deepcopy(game.p1_bots)
+        self.initial_p2_bots = copy.deepcopy(game.p2_bots)
+        self.initial_round = game.round
+        self.buffer = bytearray()
+        self.num_turns = 0
+        self.last_actions = [Action() for _ in range(2 * NUM_BOTS)]
+
+    def __len__(self):
+        """
+        Returns the number of snapshots, i.e. the initial state plus one per turn.
+        """
+        return self.num_turns + 1
+
+    def nbytes(self):
+        """
+        Returns the size of the recorded action deltas in bytes.
+        """
+        return len(self.buffer)
+
+    def record(self, p1_actions, p2_actions):
+        """
+        Records the (decoded) actions submitted for one turn.
+        """
+        actions = list(p1_actions) + list(p2_actions)
+        mask_pos = len(self.buffer)
+        self.buffer.append(0)
+        mask = 0
+        for i, action in enumerate(actions):
+            if action == self.last_actions[i]:
+                continue
+            mask |= 1 << i
+            self.buffer.append(action.type)
+            if action.type == LAUNCH:
+                _write_varint(self.buffer, action.target)
+                _write_varint(self.buffer, action.strength)
+        self.buffer[mask_pos] = mask
+        self.last_actions = actions
+        self.num_turns += 1
+
+    def actions(self):
+        """
+        Yields the (p1_actions, p2_actions) recorded for each turn, in order.
+        """
+        actions = [Action() for _ in range(2 * NUM_BOTS)]
+        pos = 0
+        for _ in range(self.num_turns):
+            mask = self.buffer[pos]
+            pos += 1
+            actions = list(actions)
+            for i in range(2 * NUM_BOTS):
+                if not mask & (1 << i):
+                    continue
+                action = Action(self.buffer[pos])
+                pos += 1
+                if action.type == LAUNCH:
+                    action.target, pos = _read_varint(self.buffer, pos)
+                    action.strength, pos = _read_varint(self.buffer, pos)
+                actions[i] = action
+            yield actions[:NUM_BOTS], actions[NUM_BOTS:]
+
+    def initial_game(self):
+        """
+        Returns a new Game in the recorded initial state.
+        """
+        game = Game()
+        game.p1_bots = copy.deepcopy(self.initial_p1_bots)
+        game.p2_bots = copy.deepcopy(self.initial_p2_bots)
+        game.round = self.initial_round
+        return game
+
+    def replay(self):
+        """
+        Replays the game, yielding (game, p1_actions, p2_actions) after each turn.
+        The same Game object is stepped and yielded every time.
+        """
+        game = self.initial_game()
+        for p1_actions, p2_actions in self.actions():
+            game.submit_turn(p1_actions, p2_actions)
+            yield game, p1_actions, p2_actions
+
+    def snapshots(self):
+        """
+        Rebuilds the full history in the format sent in game_over messages: a list
+        of json strings containing the game state and the actions resulting in it.
+        """
+        snapshots = [json.dumps({
+            'game_state': self.initial_game().dumps(),
+            'actions': None,
+        })]
+        for game, p1_actions, p2_actions in self.replay():
+            snapshots.append(json.dumps({
+                'game_state': game.dumps(),
+                'actions': [[action.to_json() for action in p1_actions],
+                            [action.to_json() for action in p2_actions]]
+            }))
+        return snapshots
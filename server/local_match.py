@@ -0,0 +1,96 @@
+import asyncio
+from player import GameController, decode_turn_actions
+# competitors are given the same Controller the client uses, found through
+# the client directory that game puts on the path
+from controller import Controller
+from turn_history import TurnHistory
+
+
+class LocalPlayer:
+    """
+    Stand-in for Player that runs a competitor object in-process instead of
+    talking to a websocket. It implements the part of the Player interface
+    used by GameController, so games are played with exactly the same rules,
+    results and history.
+
+    Representation:
+    competitor: object with a play_turn(controller) method, like client/competitor.py
+    username: string
+    exceptions: number of turns on which play_turn raised
+    history: TurnHistory of the game being played, as kept by the client
+    """
+
+    def __init__(self, competitor, username):
+        self.competitor = competitor
+        self.username = username
+        self.lock = asyncio.Lock()
+        self.exceptions = 0
+        self.game_over = None
+
+        # latest state sent to this player, used to build the next Controller
+        self.turn = 0
+        self.bots = None
+        self.op_bots = None
+        self.op_actions = None
+        self.errors = None
+        self.history = None
+
+    async def send_begin_message(self, game_id, bots, op_bots, op_name):
+        self.turn = 0
+        # copy the bots so the competitor can never touch the live game state
+        self.bots = [list(bot) for bot in bots]
+        self.op_bots = [list(bot) for bot in op_bots]
+        self.op_actions = [{"type": "none"} for _ in bots]
+        self.errors = [Controller.NO_ERROR for _ in bots]
+        self.history = TurnHistory(bots, op_bots)
+
+    async def send_game_update(self, game_id, turn, bots, op_bots, actions, op_actions, action_errors):
+        self.turn = turn
+        self.bots = [list(bot) for bot in bots]
+        self.op_bots = [list(bot) for bot in op_bots]
+        self.op_actions = op_actions
+        self.history.record_turn(turn, bots, op_bots, actions, op_actions)
+        # same conversion as the client: one error code per bot
+        self.errors = [Controller.NO_ERROR for _ in bots]
+        for code, bot in action_errors:
+            self.errors[bot] = code
+
+    async def send_game_over(self, game_id, winner, errors, history):
+        self.game_over = {"game_id": game_id, "winner": winner, "errors": errors, "history": history}
+
+    async def wait_for_player_turn(self, game_id, timeout):
+        """
+        Runs the competitor's play_turn and returns the decoded actions it chose.
+        Like the client, exceptions raised by play_turn are swallowed and the
+        actions set before the exception are submitted.
+
+        Malformed actions raise a TimeoutError, since the server would reject
+        them and wait for a valid turn until the deadline.
+        """
+        controller = Controller(self.turn, self.bots, self.op_bots, self.op_actions, self.errors,
+                                history=self.history)
+        try:
+            self.competitor.play_turn(controller)
+        except Exception:
+            self.exceptions += 1
+        actions = decode_turn_actions(controller.actions)
+        if actions is None:
+            raise asyncio.TimeoutError()
+        return actions
+
+
+async def play_local_match(competitor1, competitor2, username1="player1", username2="player2"):
+    """
+    Plays a full game between two competitor objects in-process.
+    Returns the finished GameController.
+    """
+    match = GameController(LocalPlayer(competitor1, username1), LocalPlayer(competitor2, username2))
+    await match.play_game()
+    return match
+
+
+def run_local_match(competitor1, competitor2, username1="player1", username2="player2"):
+    """
+    Synchronous wrapper around play_local_match for use outside an event loop.
+    """
+    return asyncio.run(play_local_match(competitor1, competitor2, username1, username2))
@@ -0,0 +1,77 @@
+"""
+Logging for the game server. Records are put on a queue by the event loop and
+written by a background thread, so a slow terminal or pipe never blocks a game.
+
+Every module logs through get_logger(name). Until setup_logging is called only
+warnings and errors reach stderr, so tools importing the server modules stay quiet.
+
+Per-turn traces (the full state sent to the players every turn) go to the
+"server.trace" logger at the TRACE level, and only for games that are traced:
+games of a player in traced_players, games in traced_games, and a
+TRACE_SAMPLE_RATE fraction of all games. Whether a game is traced is decided by
+the caller, so untraced games pay a single attribute check per turn.
+
+Levels and traces can be set when starting the server:
+    LOG_LEVEL=DEBUG TRACE_PLAYERS=alice,bob TRACE_SAMPLE_RATE=0.01 python server.py
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+# below DEBUG, only emitted for traced games
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+# fraction of games whose turns are traced
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+
+# usernames and game ids whose turns are traced; can be changed while running
+traced_players = set(filter(None, os.environ.get("TRACE_PLAYERS", "").split(",")))
+traced_games = set(filter(None, os.environ.get("TRACE_GAMES", "").split(",")))
+
+ROOT_LOGGER = "server"
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+trace_logger = get_logger("trace")
+
+
+def should_trace(game_id, *usernames):
+    """
+    Decides once per game whether its turns are traced.
+    """
+    if game_id in traced_games or any(username in traced_players for username in usernames):
+        return True
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+def setup_logging(level=LOG_LEVEL, filename=None):
+    """
+    Sends the server's log records through a queue to a background thread that
+    writes them to filename, or to stderr if no filename is given.
+    Returns the QueueListener running the thread; it is stopped at exit.
+    """
+    records = queue.SimpleQueue()
+    output = logging.FileHandler(filename) if filename else logging.StreamHandler(sys.stderr)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(logging.getLevelName(level) if isinstance(level, str) else level)
+    logger.handlers = [logging.handlers.QueueHandler(records)]
+    logger.propagate = False
+    # traces are only logged for traced games, whatever the level
+    trace_logger.setLevel(TRACE)
+
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,224 @@
+"""
+Minimal metrics registry for the game server, exposed over HTTP in the
+Prometheus text format:
+    curl http://localhost:8002/metrics
+
+Metrics are created once at module level and updated from the hot path with
+plain dictionary updates; all formatting happens when the endpoint is scraped.
+"""
+import asyncio
+import bisect
+import collections
+import time
+
+METRICS_HOST = "localhost"
+METRICS_PORT = 8002
+
+# seconds between event loop lag measurements
+LOOP_LAG_INTERVAL = 0.5
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# references to the tasks started here, so they are not garbage collected
+_tasks = set()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    Base class of all metrics. Values are kept per tuple of label values, in
+    the order of labelnames.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = dict()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def remove(self, **labels):
+        """
+        Drops the series of the given label values, e.g. of a player who left.
+        """
+        self.values.pop(self._key(labels), None)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        for key, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down. If function is given, the gauge has no
+    labels and its value is read from function() at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self.function is not None:
+            yield f"{self.name} {self.function()}"
+        else:
+            yield from super()._samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            # one count per bucket, then +Inf, then the sum of observations
+            counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _samples(self):
+        for key, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {counts[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = dict()
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), function=None):
+    return REGISTRY.register(Gauge(name, documentation, labelnames, function))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+class RateWindow:
+    """
+    Counts events over a sliding window, e.g. games completed in the last minute.
+    """
+
+    def __init__(self, window=60):
+        self.window = window
+        self.events = collections.deque()
+
+    def add(self):
+        self.events.append(time.monotonic())
+
+    def count(self):
+        cutoff = time.monotonic() - self.window
+        while self.events and self.events[0] < cutoff:
+            self.events.popleft()
+        return len(self.events)
+
+
+LOOP_LAG = histogram("event_loop_lag_seconds", "Delay of event loop wakeups past their deadline",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """
+    Measures how late the event loop wakes up from a sleep, forever.
+    """
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, time.monotonic() - start - interval))
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # skip the headers
+        while (await reader.readline()).strip():
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Starts the HTTP scrape endpoint and the event loop lag monitor.
+    Returns the asyncio server.
+    """
+    task = asyncio.create_task(monitor_loop_lag())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return await asyncio.start_server(_handle_scrape, host, port)
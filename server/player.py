@@ -1,25 +1,190 @@
-from game import Game, P1_WIN, P2_WIN, TIE
+from game import Game, Action, P1_WIN, P2_WIN, TIE, NUM_BOTS, LAUNCH, ACTION_CODES
+import protocol
+from history import GameHistory
+import metrics
+import log
 import json
-import jsonschema
 import websockets
 from websockets.exceptions import ConnectionClosed
 import asyncio
+import collections
+import time
 import uuid
 
 MAX_MESSAGE_SIZE = 2000
 
+# Outbound queue settings. When a player's queue is full, the overflow policy 
+# decides what happens to the new message:
+#   DROP: the new message is discarded
+#   COALESCE: queued game updates, which the new message supersedes, are 
+#             discarded; if there are none the oldest message is discarded
+#   DISCONNECT: the player's connection is closed
+DROP, COALESCE, DISCONNECT = "drop", "coalesce", "disconnect"
+SEND_QUEUE_SIZE = 32
+SEND_OVERFLOW_POLICY = COALESCE
+
+logger = log.get_logger("player")
+
+# metrics, scraped from the endpoint started by metrics.serve_metrics
+TURN_LATENCY = metrics.histogram(
+    "turn_response_seconds", "Time from waiting for a player's turn to receiving a valid one",
+    ["player"], buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 1.5, 2, 2.5, 2.75, 3))
+TURN_TIMEOUTS = metrics.counter(
+    "turn_timeouts_total", "Turns not received before the deadline", ["player"])
+INVALID_MESSAGES = metrics.counter(
+    "invalid_messages_total", "Messages rejected while waiting for a turn", ["player"])
+# series labeled by username, dropped when the player disconnects
+PLAYER_METRICS = (TURN_LATENCY, TURN_TIMEOUTS, INVALID_MESSAGES)
+SEND_QUEUE_LATENCY = metrics.histogram(
+    "send_queue_seconds", "Time from queueing a message to finishing sending it")
+SEND_QUEUE_DEPTH = metrics.histogram(
+    "send_queue_depth", "Messages in a player's send queue after queueing one",
+    buckets=(1, 2, 4, 8, 16, SEND_QUEUE_SIZE - 1))
+MESSAGES_SENT = metrics.counter("messages_sent_total", "Messages sent to players")
+MESSAGES_DROPPED = metrics.counter(
+    "send_queue_dropped_total", "Messages discarded because a send queue was full")
+MESSAGES_COALESCED = metrics.counter(
+    "send_queue_coalesced_total", "Queued game updates replaced by a newer one")
+GAMES_IN_PROGRESS = metrics.gauge("games_in_progress", "Games currently being played")
+GAMES_COMPLETED = metrics.counter("games_completed_total", "Games played to the end")
+_recent_games = metrics.RateWindow(60)
+metrics.gauge("games_completed_last_minute", "Games completed in the last 60 seconds",
+              function=_recent_games.count)
+
+class SendQueueFull(Exception):
+    """
+    Raised when a message is sent to a player that was disconnected because 
+    their send queue overflowed.
+    """
+
 class Player:
-    def __init__(self, websocket, username):
+    """
+    A logged in player. Outbound messages go through a bounded queue drained by
+    a writer task, so sending never waits on the player's socket.
+
+    Representation:
+    websocket: the player's connection
+    username: string
+    lock: held while the player is in a game
+    send_queue: deque of (message, is_game_update, time queued) waiting to be sent
+    send_error: exception that stopped the writer task, or None
+    send_idle: set while the writer has nothing left to send
+    closing: task closing the connection after a send queue overflow, or None
+    responsive: False if the player stopped answering heartbeat pings
+    rtt, avg_rtt: last and smoothed ping round trip time in seconds, or None
+    encoding: wire encoding of game updates chosen at login (protocol.JSON or protocol.BINARY)
+    """
+    def __init__(self, websocket, username, queue_size=SEND_QUEUE_SIZE, overflow=SEND_OVERFLOW_POLICY,
+                 encoding=protocol.JSON):
         self.websocket = websocket
         self.username = username
+        self.encoding = encoding
         self.lock = asyncio.Lock()
+
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.send_queue = collections.deque()
+        self.send_ready = asyncio.Event()
+        self.send_idle = asyncio.Event()
+        self.send_idle.set()
+        self.send_error = None
+        self.writer = None
+        self.closing = None
+
+        # maintained by the HeartbeatScheduler
+        self.responsive = True
+        self.ping_sent = None
+        self.rtt = None
+        self.avg_rtt = None
+
+    def queue_message(self, message, is_game_update=False):
+        """
+        Adds a message to the send queue, applying the overflow policy if the
+        queue is full.
+
+        Raises the exception that stopped the writer if the connection failed,
+        so callers notice disconnected players like they would on a direct send.
+        """
+        if self.send_error is not None:
+            raise self.send_error
+        if len(self.send_queue) >= self.queue_size:
+            if self.overflow == DISCONNECT:
+                self.send_error = SendQueueFull(self.username)
+                self.send_queue.clear()
+                self.closing = asyncio.create_task(self.websocket.close())
+                raise self.send_error
+            if self.overflow == DROP:
+                MESSAGES_DROPPED.inc()
+                return
+            # COALESCE: a newer state makes queued game updates obsolete
+            kept = [item for item in self.send_queue if not item[1]]
+            if len(kept) < len(self.send_queue):
+                MESSAGES_COALESCED.inc(len(self.send_queue) - len(kept))
+            self.send_queue = collections.deque(kept)
+            if len(self.send_queue) >= self.queue_size:
+                self.send_queue.popleft()
+                MESSAGES_DROPPED.inc()
+
+        self.send_queue.append((message, is_game_update, time.monotonic()))
+        SEND_QUEUE_DEPTH.observe(len(self.send_queue))
+        self.send_ready.set()
+        self.send_idle.clear()
+        if self.writer is None:
+            self.writer = asyncio.create_task(self.write_messages())
+
+    async def write_messages(self):
+        """
+        Writer task: sends queued messages in order until the connection fails.
+        """
+        try:
+            while True:
+                while self.send_queue:
+                    message, _, queued = self.send_queue.popleft()
+                    await self.websocket.send(message)
+                    MESSAGES_SENT.inc()
+                    SEND_QUEUE_LATENCY.observe(time.monotonic() - queued)
+                self.send_ready.clear()
+                self.send_idle.set()
+                await self.send_ready.wait()
+        except Exception as e:
+            self.send_error = e
+            self.send_queue.clear()
+            self.send_idle.set()
+
+    def close(self):
+        """
+        Stops the writer task and drops the player's metrics. Called when the
+        player disconnects.
+        """
+        if self.writer is not None:
+            self.writer.cancel()
+        self.drop_metrics()
+
+    async def aclose(self):
+        """
+        Waits for the queued messages to be sent, then closes like close().
+        Used for players whose connection outlives the Player, e.g. the relay
+        players of a sharded game, so the last messages of the game still go
+        out and the writer task does not stay pending.
+        """
+        if self.writer is not None and not self.writer.done():
+            await self.send_idle.wait()
+        self.close()
+
+    def drop_metrics(self):
+        """
+        Removes the player's labeled metric series, so they do not pile up as
+        players come and go.
+        """
+        for metric in PLAYER_METRICS:
+            metric.remove(player=self.username)
     
     async def send_message(self, message):
-        await self.websocket.send(message)
+        self.queue_message(message)
 
     async def send_begin_message(self, game_id, bots, op_bots, op_name):
-        print('sent begin msg to ', self.username)
-        await self.websocket.send(json.dumps({
+        logger.debug("sent begin message to %s", self.username)
+        self.queue_message(json.dumps({
             "type": "begin_game",
             "game_id": game_id,
             "op_name": op_name,
@@ -30,9 +195,13 @@ class Player:
         }))
     
     async def send_game_update(self, game_id, turn, bots, op_bots, actions, op_actions, action_errors):
-        print('turn', turn, 'sent game update to', self.username, 
-        'with value', bots, op_bots, action_errors)
-        await self.websocket.send(json.dumps({
+        if self.encoding == protocol.BINARY:
+            message = protocol.encode_game_update(game_id, turn, bots, op_bots, actions, op_actions, action_errors)
+            # values that do not fit the binary layout are sent as json
+            if message is not None:
+                self.queue_message(message, is_game_update=True)
+                return
+        self.queue_message(json.dumps({
             "type": "game_update",
             "game_id": game_id,
             "turn": turn,
@@ -41,7 +210,7 @@ class Player:
             "actions": actions,
             "op_actions": op_actions,
             "errors": action_errors
-        }))
+        }), is_game_update=True)
 
     async def send_game_over(self, game_id, winner, errors, history):
         """
@@ -49,8 +218,8 @@ class Player:
         an exception if the send fails. 
         """
         try:
-            print('sending game over', winner, errors)
-            await self.websocket.send(json.dumps({
+            logger.debug("sending game over to %s: winner %s, errors %s", self.username, winner, errors)
+            self.queue_message(json.dumps({
                 "type": "game_over",
                 "game_id": game_id,
                 "winner": winner,
@@ -77,37 +246,47 @@ class Player:
                 response = await self.websocket.recv()
                 player_actions = self.parse_turn_message(game_id, response)
                 if player_actions is None:
+                    INVALID_MESSAGES.inc(player=self.username)
                     await self.send_invalid_message()
             return player_actions
 
-        return await asyncio.wait_for(receive_helper(), timeout)
+        start = time.monotonic()
+        try:
+            player_actions = await asyncio.wait_for(receive_helper(), timeout)
+        except asyncio.TimeoutError:
+            TURN_TIMEOUTS.inc(player=self.username)
+            raise
+        TURN_LATENCY.observe(time.monotonic() - start, player=self.username)
+        return player_actions
     
     def parse_turn_message(self, game_id, turn_message):
         """
-        Returns a list of actions for this player, or None if the input is invalid.
-        turn_message is expected to be a json string as described in server.py7
+        Returns a list of decoded Actions for this player, or None if the input is invalid.
+        turn_message is expected to be a json string as described in server.py,
+        or a binary turn message (see client/protocol.py)
         """
         if len(turn_message) > MAX_MESSAGE_SIZE:
             # ignore overly large json responses
             return None
+        if isinstance(turn_message, bytes):
+            return decode_binary_turn(game_id, turn_message)
         try:
             result = json.loads(turn_message)
-            try:
-                jsonschema.validate(result, SUBMIT_TURN_SCHEMA)
-            except Exception as e:
-                print(e)
-            if ('type' in result and 'actions' in result
-                and result['type'] == 'turn' and 
-                result['game_id'] == game_id):
-                return result['actions']
-        except:
+        except (ValueError, RecursionError):
+            # RecursionError: deeply nested arrays fit under MAX_MESSAGE_SIZE
+            return None
+        if (type(result) is not dict or result.get('type') != 'turn' or 
+            result.get('game_id') != game_id):
             return None
+        if 'turn' in result and not _is_number(result['turn']):
+            return None
+        return decode_turn_actions(result.get('actions'))
     
     async def send_invalid_message(self):
         """
         Send a message to the player that their request was invalid.
         """
-        await self.websocket.send(json.dumps({ "type": "invalid_request" }))
+        self.queue_message(json.dumps({ "type": "invalid_request" }))
 
 class GameController:
     """
@@ -122,25 +301,26 @@ class GameController:
                     assumes no games are in progress between the two players right now
     """
     
-    def __init__(self, player1: Player, player2: Player):
+    def __init__(self, player1: Player, player2: Player, game_id=None):
         """
-        Initializes a game between two players.
+        Initializes a game between two players, with a new id unless game_id
+        is given.
         """
         self.player1 = player1 
         self.player2 = player2
         self.game = Game()
-        # records gamestate and actions taken resulting in the gamestate
-        self.history = [json.dumps({
-            'game_state': self.game.dumps(),
-            'actions': None,
-        })]
+        # records the initial gamestate and the actions taken each turn;
+        # full gamestate snapshots are rebuilt from it when the game ends
+        self.history = GameHistory(self.game)
 
         self.game_ended = False
 
         self.winner = None
         self.errored_players = None
 
-        self.id = str(uuid.uuid4())
+        self.id = game_id or str(uuid.uuid4())
+        # per-turn traces are only logged for some games, see log.py
+        self.traced = log.should_trace(self.id, player1.username, player2.username)
 
     def get_id(self):
         """
@@ -148,6 +328,12 @@ class GameController:
         """
         return self.id
 
+    def get_num_turns(self):
+        """
+        Returns the number of turns played so far
+        """
+        return self.history.num_turns
+
     def is_game_over(self):
         """
         Returns if the game has ended or not (whether from player disconnect, 
@@ -176,7 +362,8 @@ class GameController:
         If a player disconnects or times out during the game, they automatically lose. 
         If both players disconnect/time out or any one times out before the game, there is a tie.
         """
-        print('playing game')
+        logger.debug("game %s between %s and %s waiting for players",
+                     self.id, self.player1.username, self.player2.username)
         # acquire player locks in order
         # ensures that a player is only in one game at once
         if (self.player1.username < self.player2.username):
@@ -185,6 +372,8 @@ class GameController:
         else:
             await self.player2.lock.acquire()
             await self.player1.lock.acquire()
+        GAMES_IN_PROGRESS.inc()
+        played = False
         
         try:
             # send game begin messages to each player
@@ -193,7 +382,7 @@ class GameController:
                     self.id, self.game.p1_bots, self.game.p2_bots, self.player2.username
                 )
             except:
-                print('begin error', self.player1.username)
+                logger.info("game %s: could not start, %s disconnected", self.id, self.player1.username)
                 self.errored_players = (self.player1.username,)
                 return
             try:
@@ -201,11 +390,11 @@ class GameController:
                     self.id, self.game.p2_bots, self.game.p1_bots, self.player1.username
                 )
             except:
-                print('begin error', self.player2.username)
+                logger.info("game %s: could not start, %s disconnected", self.id, self.player2.username)
                 self.errored_players = (self.player2.username,)
                 # if player 2 errors but player 1 didn't error, we tell player 1
                 # that the game is over
-                await self.player1.send_game_over(self.get_id(), None, self.errored_players, self.history)
+                await self.player1.send_game_over(self.get_id(), None, self.errored_players, self.history.snapshots())
                 return
             
             # run the game
@@ -221,20 +410,30 @@ class GameController:
                         self.winner = self.player1.username
                     # if len(errors) then it's a tie b/c both errored
                     break
+            played = True
             
             winner_code = self.game.get_winner()
             if winner_code == P1_WIN:
                 self.winner = self.player1.username
             elif winner_code == P2_WIN:
                 self.winner = self.player2.username
+            logger.info("game %s between %s and %s over after %d turns: winner %s, errors %s",
+                        self.id, self.player1.username, self.player2.username,
+                        len(self.history) - 1, self.winner, self.errored_players)
             
             # send game end messages to each player
-            await self.player1.send_game_over(self.get_id(), self.winner, self.errored_players, self.history)
-            await self.player2.send_game_over(self.get_id(), self.winner, self.errored_players, self.history)
-        except Exception as e:
-            print(f'error in game {self.get_id()}, {e}')
+            history = self.history.snapshots()
+            await self.player1.send_game_over(self.get_id(), self.winner, self.errored_players, history)
+            await self.player2.send_game_over(self.get_id(), self.winner, self.errored_players, history)
+        except Exception:
+            logger.exception("error in game %s", self.get_id())
         finally:
             self.game_ended = True
+            GAMES_IN_PROGRESS.dec()
+            # games that could not start are not counted
+            if played:
+                GAMES_COMPLETED.inc()
+                _recent_games.add()
             self.player1.lock.release()
             self.player2.lock.release()
     
@@ -261,14 +460,18 @@ class GameController:
         if len(errors) > 0:
             return errors
         
-        player1_actions, player2_actions = actions
-
         # update the actual game
         self.game.submit_turn(*actions)
-        self.history.append(json.dumps({
-            'game_state': self.game.dumps(), 
-            'actions': actions
-        }))
+        self.history.record(*actions)
+
+        # actions are echoed back to the players in the json wire format
+        player1_actions = [action.to_json() for action in actions[0]]
+        player2_actions = [action.to_json() for action in actions[1]]
+        if self.traced:
+            log.trace_logger.log(log.TRACE, "game %s turn %d: %s bots %s actions %s errors %s, "
+                "%s bots %s actions %s errors %s", self.id, len(self.history) - 1,
+                self.player1.username, self.game.p1_bots, player1_actions, self.game.p1_errors,
+                self.player2.username, self.game.p2_bots, player2_actions, self.game.p2_errors)
 
         # send game updates
         game_updates = await asyncio.gather(
@@ -285,11 +488,63 @@ class GameController:
         return errors
 
 
-# TODO: validation with schema
+def _is_number(value):
+    return type(value) in (int, float)
+
+
+def decode_binary_turn(game_id, turn_message):
+    """
+    Returns a list of NUM_BOTS Actions decoded from a binary turn message,
+    or None if it is malformed or for another game.
+    """
+    decoded = protocol.decode_turn(turn_message)
+    if decoded is None or decoded[0] != game_id:
+        return None
+    return [Action(code, target, strength) if code == LAUNCH else Action(code)
+            for code, target, strength in decoded[2]]
+
+
+def decode_turn_actions(actions):
+    """
+    Validates the actions of a turn message against SUBMIT_TURN_SCHEMA in a 
+    single pass and decodes them. 
+
+    Returns a list of NUM_BOTS Actions, or None if the actions are malformed.
+    Out of range targets and strengths are not rejected here; the game reports
+    them as INVALID_TARGET and NOT_ENOUGH_AMMO errors.
+    """
+    if type(actions) is not list or len(actions) != NUM_BOTS:
+        return None
+    decoded = []
+    for action in actions:
+        if type(action) is not dict:
+            return None
+        # unhashable types (lists, dicts) would make the lookup raise
+        action_type = action.get("type")
+        code = ACTION_CODES.get(action_type) if type(action_type) is str else None
+        if code is None:
+            return None
+        # bool is a subclass of int, so compare exact types
+        target = action.get("target", 0)
+        strength = action.get("strength", 0)
+        if type(target) is not int or type(strength) is not int:
+            return None
+        if code == LAUNCH:
+            if "target" not in action or "strength" not in action:
+                return None
+            decoded.append(Action(code, target, strength))
+        else:
+            decoded.append(Action(code))
+    return decoded
+
+
+# Turn message format accepted by Player.parse_turn_message.
+# The checks are hand-written in decode_turn_actions; keep the two in sync.
 SUBMIT_TURN_SCHEMA = {
     "type": "object",
+    "required": ["type", "game_id", "actions"],
     "properties": { 
-        "type": {"type": "string"},
+        "type": {"const": "turn"},
         "game_id": {"type": "string"},
         "turn": {"type": "number"},
         "actions": {
@@ -298,13 +553,18 @@ SUBMIT_TURN_SCHEMA = {
             #     ...for each bot in order
             # ]
             "type": "array",
+            "minItems": NUM_BOTS,
+            "maxItems": NUM_BOTS,
             "items": { # validate each item of the actions arr
                 "type": "object",
+                "required": ["type"],
                 "properties": {
-                    "type": { "type": "string", "pattern": "^none|load|launch|shield$"},
-                    "target": { "type": "integer", "minimum": 0, "maximum": 2 },
-                    "strength": { 'type': "integer" }
-                }
+                    "type": { "enum": ["none", "load", "launch", "shield"] },
+                    "target": { "type": "integer" },
+                    "strength": { "type": "integer" }
+                },
+                "if": { "properties": { "type": { "const": "launch" } } },
+                "then": { "required": ["target", "strength"] }
             }
         }    
     }
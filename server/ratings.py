@@ -0,0 +1,96 @@
+"""
+Elo ratings of the players, updated after every game.
+
+Each game only changes the ratings of its two players, so ratings stay current
+without replaying a round-robin. New players move fast (a larger K factor for
+their first PROVISIONAL_GAMES games) so their rating settles after a few games.
+"""
+import random
+
+INITIAL_RATING = 1500
+# rating points exchanged by a game, for provisional and settled players
+PROVISIONAL_K = 48
+K_FACTOR = 24
+PROVISIONAL_GAMES = 20
+# random noise added to ratings when pairing, so players close in rating meet
+# each other without always being given the same opponent
+PAIRING_SPREAD = 100
+
+
+def expected_score(rating, op_rating):
+    """
+    Returns the expected score (1 for a win, 0.5 for a tie) against op_rating.
+    """
+    return 1 / (1 + 10 ** ((op_rating - rating) / 400))
+
+
+class Ratings:
+    """
+    Representation:
+    ratings: dictionary mapping usernames to [rating, games rated]
+    results_store: ResultsStore the ratings are persisted in, or None
+    """
+
+    def __init__(self, results_store=None):
+        self.ratings = dict()
+        self.results_store = results_store
+
+    async def load(self):
+        """
+        Loads the ratings saved in the results store.
+        """
+        if self.results_store is not None:
+            for row in await self.results_store.ratings():
+                self.ratings[row["player"]] = [row["rating"], row["games"]]
+
+    def get(self, username):
+        return self.ratings.get(username, (INITIAL_RATING, 0))[0]
+
+    def _entry(self, username):
+        if username not in self.ratings:
+            self.ratings[username] = [INITIAL_RATING, 0]
+        return self.ratings[username]
+
+    def update(self, player1, player2, winner, errored=None):
+        """
+        Updates the ratings of the two usernames after a game, given the
+        username of the winner (None for a tie) and the usernames that errored.
+        Ties in which a player errored say nothing about strength and are not
+        rated.
+        """
+        if player1 == player2 or (winner is None and errored):
+            return
+        entry1, entry2 = self._entry(player1), self._entry(player2)
+        score = 0.5 if winner is None else float(winner == player1)
+        change = score - expected_score(entry1[0], entry2[0])
+        entry1[0] += self._k(entry1) * change
+        entry2[0] -= self._k(entry2) * change
+        entry1[1] += 1
+        entry2[1] += 1
+        if self.results_store is not None:
+            self.results_store.update_rating(player1, *entry1)
+            self.results_store.update_rating(player2, *entry2)
+
+    def _k(self, entry):
+        return PROVISIONAL_K if entry[1] < PROVISIONAL_GAMES else K_FACTOR
+
+    def ranking(self):
+        """
+        Returns the rated usernames, highest rating first.
+        """
+        return sorted(self.ratings, key=self.get, reverse=True)
+
+    def pair_players(self, pool):
+        """
+        Pairs the players of the list pool with opponents of similar rating.
+        Returns a list of (player, player) tuples; with an odd number of
+        players, one is left out.
+        """
+        noisy = {player.username: self.get(player.username) + random.gauss(0, PAIRING_SPREAD)
+                 for player in pool}
+        ordered = sorted(pool, key=lambda player: noisy[player.username])
+        # with an odd number of players, leave out a random one rather than
+        # always the lowest or highest rated
+        if len(ordered) % 2:
+            ordered.pop(random.randrange(len(ordered)))
+        return list(zip(ordered[0::2], ordered[1::2]))
@@ -0,0 +1,313 @@
+"""
+Replay archives: finished games stored in a compact binary format that can be
+read back a single turn at a time.
+
+An archive file holds a batch of games:
+    file header: magic, version, bots per player, turn record size
+    for each game:
+        game header: game id, number of turn records, result, username lengths
+        the two usernames (utf-8)
+        one fixed-width turn record per snapshot (the initial state, then one
+        per turn): for each bot of player 1 then player 2, its health, ammo,
+        action (type, target, strength) and error code
+    index: for each game, the offsets of its header and of its first turn record
+    footer: offset of the index, number of games, magic
+
+Since turn records have a fixed width, turn t of game g is read from
+index[g] + t * TURN_RECORD.size, through an mmap of the file, without parsing
+anything else. Archives cut short (by a crash, or still being written) have no
+index; the reader then rebuilds it by skipping from game header to game header.
+
+Browse an archive with the client visualizer:
+    python client/visualizer.py server/replays/<file>.replay
+"""
+import asyncio
+import concurrent.futures
+import mmap
+import os
+import struct
+import time
+import uuid
+from game import NUM_BOTS, P1_WIN, P2_WIN, TIE, ACTION_TYPES, LAUNCH
+
+REPLAY_DIR = "replays"
+# games per archive file
+REPLAY_BATCH_SIZE = 1000
+
+MAGIC = b"CPWR"
+INDEX_MAGIC = b"CPWI"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sBBH")
+# game id, number of turn records, status (P1_WIN, P2_WIN or TIE), errored
+# players (bit 0: player 1, bit 1: player 2), username lengths
+GAME_HEADER = struct.Struct("<16sHBBBB")
+# per bot: health, ammo, action type, target, strength, error code (-1 for none)
+BOT_RECORD = "BHBbhb"
+TURN_RECORD = struct.Struct("<" + BOT_RECORD * 2 * NUM_BOTS)
+INDEX_ENTRY = struct.Struct("<QQ")
+FOOTER = struct.Struct("<QI4s")
+
+NO_ERROR = -1
+
+
+def _clamp(value, low, high):
+    return low if value < low else high if value > high else value
+
+
+def _bot_fields(bot, action, error):
+    # targets and strengths are whatever the player sent; out of range values
+    # are clamped to values that are just as invalid
+    if action is None or action.type != LAUNCH:
+        target, strength = 0, 0
+    else:
+        target, strength = _clamp(action.target, -128, 127), _clamp(action.strength, -32768, 32767)
+    return (bot[0], _clamp(bot[1], 0, 65535), 0 if action is None else action.type,
+            target, strength, error)
+
+
+def _error_codes(errors):
+    codes = [NO_ERROR] * NUM_BOTS
+    for code, bot in errors:
+        codes[bot] = code
+    return codes
+
+
+def pack_turn(p1_bots, p2_bots, p1_actions=None, p2_actions=None, p1_errors=(), p2_errors=()):
+    """
+    Returns the turn record of a game state and the actions and errors that
+    led to it (None for the initial state).
+    """
+    fields = []
+    for bots, actions, errors in ((p1_bots, p1_actions, p1_errors), (p2_bots, p2_actions, p2_errors)):
+        codes = _error_codes(errors)
+        for i, bot in enumerate(bots):
+            fields.extend(_bot_fields(bot, actions[i] if actions else None, codes[i]))
+    return TURN_RECORD.pack(*fields)
+
+
+def unpack_turn(buffer, offset=0):
+    """
+    Decodes a turn record. Returns a dict with the bots, json actions and
+    errors of each player, in the formats used by the server messages.
+    """
+    fields = TURN_RECORD.unpack_from(buffer, offset)
+    turn = dict()
+    width = len(BOT_RECORD)
+    for player in ("p1", "p2"):
+        bots, actions, errors = [], [], []
+        start = 0 if player == "p1" else NUM_BOTS * width
+        for bot in range(NUM_BOTS):
+            health, ammo, type, target, strength, error = fields[start + bot * width:start + (bot + 1) * width]
+            bots.append([health, ammo])
+            if type == LAUNCH:
+                actions.append({"type": "launch", "target": target, "strength": strength})
+            else:
+                actions.append({"type": ACTION_TYPES[type]})
+            if error != NO_ERROR:
+                errors.append((error, bot))
+        turn[f"{player}_bots"] = bots
+        turn[f"{player}_actions"] = actions
+        turn[f"{player}_errors"] = errors
+    return turn
+
+
+def pack_game(match):
+    """
+    Returns the game header, usernames and turn records of a finished
+    GameController as bytes.
+    """
+    history = match.history
+    initial = history.initial_game()
+    records = [pack_turn(initial.p1_bots, initial.p2_bots)]
+    for game, p1_actions, p2_actions in history.replay():
+        records.append(pack_turn(game.p1_bots, game.p2_bots, p1_actions, p2_actions,
+                                 game.p1_errors, game.p2_errors))
+    winner, errored = match.get_results()
+    username1, username2 = match.player1.username, match.player2.username
+    status = P1_WIN if winner == username1 else P2_WIN if winner == username2 else TIE
+    errored = errored or ()
+    errored_bits = (username1 in errored) | (username2 in errored) << 1
+    name1, name2 = username1.encode()[:255], username2.encode()[:255]
+    try:
+        game_id = uuid.UUID(match.get_id()).bytes
+    except ValueError:
+        game_id = bytes(16)
+    header = GAME_HEADER.pack(game_id, len(records), status, errored_bits, len(name1), len(name2))
+    return b"".join([header, name1, name2] + records)
+
+
+class ReplayWriter:
+    """
+    Appends finished games to archive files in REPLAY_DIR, starting a new file
+    every batch_size games. Games are encoded and written by a worker thread,
+    so the event loop never waits on the disk.
+
+    Representation:
+    directory: folder the archives are written to
+    batch_size: number of games per archive
+    executor: single worker thread doing all encoding and file writes
+    file: archive being written, or None
+    path: file name of the archive being written
+    index: offsets (game header, first turn record) of the games in file
+    """
+
+    def __init__(self, directory=REPLAY_DIR, batch_size=REPLAY_BATCH_SIZE):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.file = None
+        self.index = []
+        self.path = None
+        self.num_files = 0
+        self.writes = set()
+
+    def write_match(self, match):
+        """
+        Queues a finished GameController to be written. Never blocks.
+        """
+        write = asyncio.get_running_loop().run_in_executor(self.executor, self._write, match)
+        self.writes.add(write)
+        write.add_done_callback(self.writes.discard)
+
+    def _write(self, match):
+        data = pack_game(match)
+        if self.file is None:
+            self._open()
+        offset = self.file.tell()
+        *_, length1, length2 = GAME_HEADER.unpack_from(data)
+        self.index.append((offset, offset + GAME_HEADER.size + length1 + length2))
+        self.file.write(data)
+        self.file.flush()
+        if len(self.index) >= self.batch_size:
+            self._close_file()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # the pid keeps the files of several server processes apart
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.num_files}.replay"
+        self.num_files += 1
+        self.path = os.path.join(self.directory, name)
+        self.file = open(self.path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, NUM_BOTS, TURN_RECORD.size))
+        self.index = []
+
+    def _close_file(self):
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(FOOTER.pack(index_offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+        self.file = None
+
+    async def close(self):
+        """
+        Waits for the queued games and finishes the current archive.
+        """
+        def close_file():
+            if self.file is not None:
+                self._close_file()
+        await asyncio.get_running_loop().run_in_executor(self.executor, close_file)
+        self.executor.shutdown()
+
+
+class ReplayReader:
+    """
+    Random access to the games of an archive through an mmap of the file.
+    Only the index is read when opening; games and turns are decoded on demand.
+
+    Representation:
+    data: mmap of the archive, or None if the file is too short to hold a
+          file header (e.g. the server crashed before its first write)
+    offsets: list of (game header offset, first turn record offset) per game
+    data_end: offset of the end of the last game
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            # empty files cannot be mapped, and have no games
+            if os.fstat(f.fileno()).st_size < FILE_HEADER.size:
+                self.data = None
+                self.offsets = []
+                self.data_end = FILE_HEADER.size
+                return
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_bots, record_size = FILE_HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a replay archive")
+        if num_bots != NUM_BOTS or record_size != TURN_RECORD.size:
+            raise ValueError(f"{path} was written for {num_bots} bots per player")
+        self.offsets = self._read_index()
+
+    def _read_index(self):
+        if len(self.data) >= FILE_HEADER.size + FOOTER.size:
+            index_offset, num_games, magic = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+            if magic == INDEX_MAGIC:
+                self.data_end = index_offset
+                return [INDEX_ENTRY.unpack_from(self.data, index_offset + i * INDEX_ENTRY.size)
+                        for i in range(num_games)]
+        # no index: walk the game headers, ignoring a game cut off at the end
+        offsets = []
+        offset = FILE_HEADER.size
+        while offset + GAME_HEADER.size <= len(self.data):
+            _, num_records, _, _, length1, length2 = GAME_HEADER.unpack_from(self.data, offset)
+            turns_offset = offset + GAME_HEADER.size + length1 + length2
+            end = turns_offset + num_records * TURN_RECORD.size
+            if end > len(self.data):
+                break
+            offsets.append((offset, turns_offset))
+            offset = end
+        self.data_end = offset
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def num_turns(self, game):
+        """
+        Returns the number of turns played in a game; turns 0 (the initial
+        state) to num_turns can be read.
+        """
+        # computed from the index alone, without reading the game's pages
+        end = self.offsets[game + 1][0] if game + 1 < len(self.offsets) else self.data_end
+        return (end - self.offsets[game][1]) // TURN_RECORD.size - 1
+
+    def game_info(self, game):
+        """
+        Returns a dict with the id, usernames, winner (username or None for a
+        tie), errored usernames and number of turns of a game.
+        """
+        offset, turns_offset = self.offsets[game]
+        game_id, num_records, status, errored_bits, length1, length2 = GAME_HEADER.unpack_from(self.data, offset)
+        names_offset = offset + GAME_HEADER.size
+        username1 = bytes(self.data[names_offset:names_offset + length1]).decode(errors="replace")
+        username2 = bytes(self.data[names_offset + length1:turns_offset]).decode(errors="replace")
+        winner = username1 if status == P1_WIN else username2 if status == P2_WIN else None
+        errored = tuple(username for bit, username in enumerate((username1, username2)) if errored_bits & (1 << bit))
+        return {
+            "game_id": str(uuid.UUID(bytes=game_id)),
+            "player1": username1,
+            "player2": username2,
+            "winner": winner,
+            "errors": errored,
+            "num_turns": num_records - 1,
+        }
+
+    def turn(self, game, turn):
+        """
+        Returns the state of a game after a turn (turn 0 is the initial state),
+        as decoded by unpack_turn.
+        """
+        if not 0 <= turn <= self.num_turns(game):
+            raise IndexError(f"game {game} has no turn {turn}")
+        return unpack_turn(self.data, self.offsets[game][1] + turn * TURN_RECORD.size)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
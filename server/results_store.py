@@ -0,0 +1,274 @@
+"""
+Persistent store of game results, kept in a local SQLite database.
+
+Games are recorded from the event loop without touching the disk: records are
+buffered and written in batches by a single worker thread, in one transaction
+per batch. Each batch also updates the standings table, which keeps every
+player's totals up to date so leaderboards never rescan the games.
+
+Query the store from the server directory:
+    python results_store.py leaderboard
+    python results_store.py ratings
+    python results_store.py history some_username
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import sqlite3
+import time
+import uuid
+
+RESULTS_DB = "results.db"
+# a batch is written when it reaches FLUSH_SIZE games, or FLUSH_INTERVAL
+# seconds after its first game, whichever comes first
+FLUSH_SIZE = 100
+FLUSH_INTERVAL = 1.0
+
+# same scoring as tournament_runner.rank_sort
+WIN_POINTS = 3
+TIE_POINTS = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT PRIMARY KEY,
+    player1 TEXT NOT NULL,
+    player2 TEXT NOT NULL,
+    winner TEXT,
+    errored TEXT NOT NULL, -- json list of usernames
+    turns INTEGER,
+    mode TEXT NOT NULL,
+    finished REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_by_player1 ON games (player1, finished);
+CREATE INDEX IF NOT EXISTS games_by_player2 ON games (player2, finished);
+CREATE INDEX IF NOT EXISTS games_by_time ON games (finished);
+
+CREATE TABLE IF NOT EXISTS standings (
+    player TEXT PRIMARY KEY,
+    played INTEGER NOT NULL,
+    won INTEGER NOT NULL,
+    lost INTEGER NOT NULL,
+    tied INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    last_played REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS standings_by_points ON standings (points DESC, won DESC);
+
+CREATE TABLE IF NOT EXISTS ratings (
+    player TEXT PRIMARY KEY,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL
+);
+"""
+
+STANDINGS_COLUMNS = ("played", "won", "lost", "tied", "errors", "points")
+
+
+class ResultsStore:
+    """
+    Representation:
+    path: file name of the SQLite database
+    db: connection, only used from the executor's thread after creation
+    executor: single worker thread running every database operation
+    pending: games recorded but not written yet, as tuples of games columns
+    pending_ratings: dictionary mapping usernames to their latest
+                     (rating, games) not written yet
+    flush_handle: timer that writes the pending games, or None
+    writes: futures of batches being written
+    """
+
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # created on this thread, then only used by the worker thread
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.pending = []
+        self.pending_ratings = dict()
+        self.flush_handle = None
+        self.writes = set()
+
+    def record(self, player1, player2, winner, errored, turns=None, mode="autoscrim", game_id=None):
+        """
+        Buffers the result of a finished game. Never blocks.
+
+        Args: usernames of the two players, username of the winner or None for
+        a tie, tuple of the usernames that errored (or None), number of turns
+        played if known, the server mode the game was played in, and the game's
+        id (a new one is made if not given).
+        """
+        self.pending.append((game_id or str(uuid.uuid4()), player1, player2, winner,
+                             json.dumps(list(errored or ())), turns, mode, time.time()))
+        if len(self.pending) >= FLUSH_SIZE:
+            self.flush()
+        else:
+            self._schedule_flush()
+
+    def update_rating(self, player, rating, games):
+        """
+        Buffers the new rating of a player (see ratings.py). Never blocks.
+        """
+        self.pending_ratings[player] = (rating, games)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(FLUSH_INTERVAL, self.flush)
+
+    def record_match(self, match, mode="autoscrim"):
+        """
+        Buffers the result of a finished GameController.
+        """
+        winner, errored = match.get_results()
+        self.record(match.player1.username, match.player2.username, winner, errored,
+                    match.get_num_turns(), mode, match.get_id())
+
+    def flush(self):
+        """
+        Hands the pending games to the worker thread.
+        Returns a future that is done once they are written.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        ratings, self.pending_ratings = self.pending_ratings, dict()
+        write = asyncio.get_running_loop().run_in_executor(self.executor, self._write, batch, ratings)
+        # keep a reference until written so the result is not garbage collected
+        self.writes.add(write)
+        write.add_done_callback(self.writes.discard)
+        return write
+
+    def _write(self, batch, ratings):
+        with self.db:
+            # sum the batch per player first, so each standing is updated once.
+            # Games already stored (e.g. recorded twice) are ignored and do
+            # not count towards the standings.
+            totals = dict()
+            for game in batch:
+                if self.db.execute("INSERT OR IGNORE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   game).rowcount == 0:
+                    continue
+                game_id, player1, player2, winner, errored, turns, mode, finished = game
+                errored = json.loads(errored)
+                for player in (player1, player2):
+                    if player not in totals:
+                        # STANDINGS_COLUMNS, then last_played
+                        totals[player] = [0] * len(STANDINGS_COLUMNS) + [finished]
+                    stats = totals[player]
+                    stats[0] += 1
+                    if winner is None:
+                        stats[3] += 1
+                        stats[5] += TIE_POINTS
+                    elif winner == player:
+                        stats[1] += 1
+                        stats[5] += WIN_POINTS
+                    else:
+                        stats[2] += 1
+                    if player in errored:
+                        stats[4] += 1
+                    stats[6] = max(stats[6], finished)
+
+            self.db.executemany(
+                "INSERT INTO standings VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (player) DO UPDATE SET "
+                + ", ".join(f"{column} = {column} + excluded.{column}" for column in STANDINGS_COLUMNS)
+                + ", last_played = max(last_played, excluded.last_played)",
+                [(player, *stats) for player, stats in totals.items()])
+            self.db.executemany("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?)",
+                                [(player, *rating) for player, rating in ratings.items()])
+
+    def _query(self, sql, parameters):
+        cursor = self.db.execute(sql, parameters)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    async def query(self, sql, parameters=()):
+        """
+        Runs a query on the worker thread, after any writes already queued.
+        Returns a list of dicts mapping column names to values.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._query, sql, parameters)
+
+    async def leaderboard(self, limit=None):
+        """
+        Returns the standings of the top limit players (all players if None),
+        ordered by points then wins.
+        """
+        return await self.query(LEADERBOARD_QUERY, (-1 if limit is None else limit,))
+
+    async def ratings(self):
+        """
+        Returns the saved ratings, highest first.
+        """
+        return await self.query("SELECT * FROM ratings ORDER BY rating DESC")
+
+    async def player_history(self, player, limit=50):
+        """
+        Returns the most recent games of a player, newest first.
+        """
+        return await self.query(HISTORY_QUERY, (player, player, limit))
+
+    async def close(self):
+        """
+        Writes the pending games and closes the database.
+        """
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.db.close)
+        self.executor.shutdown()
+
+
+LEADERBOARD_QUERY = "SELECT * FROM standings ORDER BY points DESC, won DESC LIMIT ?"
+
+# both sides are read through their own index and merged by time
+HISTORY_QUERY = """
+SELECT * FROM (
+    SELECT * FROM games WHERE player1 = ?
+    UNION ALL
+    SELECT * FROM games WHERE player2 = ?
+) ORDER BY finished DESC LIMIT ?
+"""
+
+
+async def _run_query(path, command, player, limit):
+    store = ResultsStore(path)
+    try:
+        if command == "leaderboard":
+            rows = await store.leaderboard(limit)
+            print(f"{'rank':<6}{'player':<20}{'points':>8}{'played':>8}{'won':>6}{'lost':>6}{'tied':>6}{'errors':>8}")
+            for rank, row in enumerate(rows):
+                print(f"{rank + 1:<6}{row['player']:<20}{row['points']:>8}{row['played']:>8}"
+                      f"{row['won']:>6}{row['lost']:>6}{row['tied']:>6}{row['errors']:>8}")
+        elif command == "ratings":
+            print(f"{'rank':<6}{'player':<20}{'rating':>8}{'games':>8}")
+            for rank, row in enumerate((await store.ratings())[:limit]):
+                print(f"{rank + 1:<6}{row['player']:<20}{row['rating']:>8.0f}{row['games']:>8}")
+        else:
+            for row in await store.player_history(player, limit or 50):
+                opponent = row["player2"] if row["player1"] == player else row["player1"]
+                outcome = "tie" if row["winner"] is None else ("won" if row["winner"] == player else "lost")
+                finished = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["finished"]))
+                print(f"{finished}  {row['mode']:<11}{outcome:<6}vs {opponent:<20}"
+                      f"{row['turns'] if row['turns'] is not None else '':>5} turns  "
+                      f"{', '.join(json.loads(row['errored']))}")
+    finally:
+        await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show stored game results.")
+    parser.add_argument("command", choices=("leaderboard", "ratings", "history"))
+    parser.add_argument("player", nargs="?", help="username, for history")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--db", default=RESULTS_DB)
+    args = parser.parse_args()
+    if args.command == "history" and args.player is None:
+        parser.error("history needs a player")
+    asyncio.run(_run_query(args.db, args.command, args.player, args.limit))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import asyncio
 import websockets
 import json
-from player import Player, GameController
-from autoscrim import autoscrim 
-from tournament_runner import run_tourney
+from player import Player, GameController, protocol
+from autoscrim import Matchmaker, game_wrapper
+from heartbeat import HeartbeatScheduler
+from tournament_runner import run_tourney, run_swiss
+import metrics
+import log
+from results_store import ResultsStore
+from ratings import Ratings
+from replay import ReplayWriter
+import functools
 import os.path
 
+logger = log.get_logger("server")
+
 # current console command
-SERVER_MODES = ("autoscrim", "tournament")
+SERVER_MODES = ("autoscrim", "tournament", "swiss")
 server_mode = SERVER_MODES[0]
 
 def check_mode():
@@ -27,26 +36,49 @@ def change_mode(mode):
     global server_mode
     if mode in SERVER_MODES:
         if mode != server_mode:
-            print(f"{mode} enabled!")
+            logger.info("%s enabled!", mode)
         server_mode = mode
 
 
 # a dict mapping player usernames to Player objects
 players = dict()
 
-async def respond(websocket, event, success):
-    await websocket.send(json.dumps({"type": event["type"], "success": success}))
+metrics.gauge("players_connected", "Logged in players", function=lambda: len(players))
+
+# pairs players for autoscrims as soon as they are available
+matchmaker = Matchmaker(players)
+
+# pings every connection; players that answer again become available for games
+heartbeat = HeartbeatScheduler(on_responsive=matchmaker.add)
+
+# seconds between checks for a server mode change
+MODE_CHECK_INTERVAL = 45
 
-async def handle_player(player):
+async def respond(websocket, event, success, encoding=None):
+    response = {"type": event["type"], "success": success}
+    if encoding is not None:
+        response["encoding"] = encoding
+    await websocket.send(json.dumps(response))
+
+def login_encoding(event):
+    """
+    Returns the wire encoding requested in a login message, json by default.
+    """
+    encoding = event.get("encoding", protocol.JSON)
+    return encoding if encoding in protocol.ENCODINGS else protocol.JSON
+
+async def handle_player(player, scheduler=heartbeat):
     global players
     websocket, username = player.websocket, player.username
-    print("Logged in", username)
+    logger.info("logged in %s", username)
 
-    # make sure web socket stays connected; ping it every 30 seconds
-    while True:
-        # TODO: figure out if this ping interferes w/ autoscrim pings
-        await websocket.ping()
-        await asyncio.sleep(5)
+    # the heartbeat scheduler keeps the connection alive and measures its 
+    # round trip time until the player disconnects
+    scheduler.add(player)
+    try:
+        await websocket.wait_closed()
+    finally:
+        scheduler.remove(player)
 
 async def handler(websocket):
     global players
@@ -64,32 +96,66 @@ async def handler(websocket):
             if username in players:
                 await respond(websocket, event, False)
             else:
-                player = Player(websocket, username)
+                player = Player(websocket, username, encoding=login_encoding(event))
                 players[username] = player
-                await respond(websocket, event, True)
+                await respond(websocket, event, True, player.encoding)
+                matchmaker.add(player)
                 break
+    if player is None:
+        # disconnected before logging in
+        return
     # then handle player
     try:
         await handle_player(player)
     except Exception as e:
-        print(f'{username} disconnected with Exception', e)
+        logger.info("%s disconnected with exception %r", username, e)
     finally:
-        if username in players:
+        if players.get(username) is player:
             del players[username]
+        matchmaker.remove(player)
+        player.close()
 
 async def main():
     global players
     global server_mode
-    async with websockets.serve(handler, "", 8001):
-        while True:
-            await asyncio.sleep(45)
-            # determine which mode we are in, then run appropriate code
-            check_mode()
-            if server_mode == SERVER_MODES[1]:
-                await run_tourney(players)
-            # we want to be in autoscrim mode by default
-            else:
-                await autoscrim(players)
+    log.setup_logging()
+    # results are kept across restarts; opened here so that importing this
+    # module (e.g. from sharded_server.py) does not open the database
+    results_store = ResultsStore()
+    ratings = Ratings(results_store)
+    await ratings.load()
+    matchmaker.results_store = results_store
+    # autoscrims pair players of similar rating
+    matchmaker.ratings = ratings
+    matchmaker.pair = ratings.pair_players
+    # finished games are archived for browsing with the visualizer
+    replays = ReplayWriter()
+    matchmaker.play = functools.partial(game_wrapper, replays=replays)
+    # metrics are served on localhost only, see metrics.py
+    await metrics.serve_metrics()
+    try:
+        async with websockets.serve(handler, "", 8001):
+            while True:
+                await asyncio.sleep(MODE_CHECK_INTERVAL)
+                # determine which mode we are in, then run appropriate code
+                check_mode()
+                if server_mode == SERVER_MODES[1]:
+                    # stop starting autoscrims while the tournament runs; games 
+                    # already in progress finish first because of the player locks
+                    matchmaker.pause()
+                    await run_tourney(players, results_store, ratings, replays=replays)
+                elif server_mode == SERVER_MODES[2]:
+                    # swiss tournament, for too many players for a round-robin
+                    matchmaker.pause()
+                    await run_swiss(players, results_store=results_store, ratings=ratings, replays=replays)
+                # we want to be in autoscrim mode by default, in which the
+                # matchmaker pairs players continuously
+                elif matchmaker.paused:
+                    matchmaker.resume()
+    finally:
+        # write the buffered results and finish the current replay archive
+        await results_store.close()
+        await replays.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -100,7 +166,9 @@ Websocket communication
 CLIENT -> SERVER
 
 Initial login
-{ "type": "login", "user": "your username" }
+{ "type": "login", "user": "your username", "encoding": optional, "json" (default) or "binary" }
+With the binary encoding, turns may be sent and game updates are received in
+the binary format described in client/protocol.py; all other messages stay json.
 
 Submit turn
 {
@@ -116,7 +184,7 @@ Submit turn
 SERVER -> CLIENT
 
 Upon client login, send
-{ "type": "login", "success": true/false }
+{ "type": "login", "success": true/false, "encoding": the encoding used if successful }
 
 When a game begins, send
 {
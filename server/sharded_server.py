@@ -0,0 +1,433 @@
+"""
+Sharded game server: runs the server across several processes so that
+connection handling, json parsing and game logic use every CPU core.
+
+Worker processes (shards) all listen on the same port (SO_REUSEPORT, so this
+mode needs Linux) and each own the websocket connections the kernel hands
+them. They run GameControllers exactly like server.py does.
+
+The coordinator process keeps the global player registry and runs the
+Matchmaker. It starts each game on the shard of the first player. When the
+second player is connected to another shard, their messages are relayed
+through the coordinator: the hosting shard sees them as a normal Player whose
+websocket is a RelayWebsocket.
+
+Each shard serves its own metrics (see metrics.py) on METRICS_PORT plus its
+shard id, since the games and connections they count live in the shard. The
+coordinator serves none.
+
+Run from the server directory:
+    python sharded_server.py --workers 8
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import uuid
+import websockets
+from autoscrim import Matchmaker
+from heartbeat import HeartbeatScheduler
+from results_store import ResultsStore
+from ratings import Ratings
+from replay import ReplayWriter
+from player import Player, GameController
+from server import respond, handle_player, login_encoding, players as server_players
+import log
+import metrics
+
+PORT = 8001
+
+logger = log.get_logger("sharded_server")
+
+
+class ShardConnection:
+    """
+    Sends and receives python objects over a multiprocessing pipe without
+    blocking the event loop on reads. Sends are small and go straight into
+    the pipe buffer.
+    """
+
+    def __init__(self, conn, on_message):
+        self.conn = conn
+        self.on_message = on_message
+        asyncio.get_running_loop().add_reader(conn.fileno(), self._read)
+
+    def _read(self):
+        try:
+            while self.conn.poll():
+                self.on_message(self.conn.recv())
+        except EOFError:
+            # the other process exited, e.g. while shutting down; stop
+            # watching the pipe instead of waking up on it forever
+            asyncio.get_running_loop().remove_reader(self.conn.fileno())
+
+    def send(self, *message):
+        self.conn.send(message)
+
+
+class RelayWebsocket:
+    """
+    Websocket stand-in for a player connected to another shard. Messages sent
+    to it are relayed through the coordinator, and messages from the player
+    are pushed into its inbox by the coordinator.
+    """
+
+    def __init__(self, coordinator, username):
+        self.coordinator = coordinator
+        self.username = username
+        self.inbox = asyncio.Queue()
+
+    async def send(self, message):
+        self.coordinator.send("relay", self.username, message)
+
+    async def recv(self):
+        return await self.inbox.get()
+
+
+class Shard:
+    """
+    A worker process owning a set of websocket connections.
+
+    Representation:
+    shard_id: index of this shard
+    coordinator: ShardConnection to the coordinator process
+    players: dictionary mapping usernames to Players connected to this shard
+    logins: pending login requests, mapping usernames to futures
+    relays: RelayWebsockets of remote players in games hosted on this shard
+    pumps: tasks forwarding messages of local players in games hosted elsewhere
+    sends: tasks sending relayed messages to local players
+    replays: ReplayWriter archiving the games hosted on this shard
+    heartbeat: HeartbeatScheduler pinging the players connected to this shard,
+               which reports their responsiveness to the coordinator
+    """
+
+    def __init__(self, shard_id, conn):
+        self.shard_id = shard_id
+        self.conn = conn
+        self.coordinator = None
+        # the registry read by the players_connected gauge of server.py
+        self.players = server_players
+        self.logins = dict()
+        self.relays = dict()
+        self.pumps = dict()
+        self.games = set()
+        self.sends = set()
+        self.replays = None
+        self.heartbeat = HeartbeatScheduler(
+            on_responsive=lambda player: self.send_responsive(player, True),
+            on_unresponsive=lambda player: self.send_responsive(player, False))
+
+    def send_responsive(self, player, responsive):
+        # the coordinator's matchmaker skips unresponsive players
+        if self.players.get(player.username) is player:
+            self.coordinator.send("responsive", player.username, responsive)
+
+    async def run(self, port, metrics_port):
+        self.coordinator = ShardConnection(self.conn, self.on_message)
+        # each shard archives the games it hosts in its own files
+        self.replays = ReplayWriter()
+        await metrics.serve_metrics(port=metrics_port + self.shard_id)
+        try:
+            async with websockets.serve(self.handler, "", port, reuse_port=True):
+                await asyncio.Future()
+        finally:
+            await self.replays.close()
+
+    async def handler(self, websocket):
+        player = None
+        # wait for login, as in server.handler
+        async for message in websocket:
+            try:
+                event = json.loads(message)
+            except json.JSONDecodeError:
+                await websocket.send(json.dumps({"type": "invalid_request"}))
+                continue
+
+            if event["type"] == "login":
+                username = str(event["user"])
+                if username in self.logins or not await self.check_login(username):
+                    await respond(websocket, event, False)
+                else:
+                    player = Player(websocket, username, encoding=login_encoding(event))
+                    self.players[username] = player
+                    self.coordinator.send("ready", username, player.encoding)
+                    break
+        if player is None:
+            # disconnected before logging in
+            return
+        # then handle player
+        try:
+            await respond(websocket, event, True, player.encoding)
+            await handle_player(player, self.heartbeat)
+        except Exception as e:
+            logger.info("%s disconnected with exception %r", player.username, e)
+        finally:
+            del self.players[player.username]
+            player.close()
+            self.stop_pump(player.username)
+            self.coordinator.send("logout", player.username)
+
+    async def check_login(self, username):
+        """
+        Asks the coordinator whether a username is free across all shards.
+        """
+        self.logins[username] = asyncio.get_running_loop().create_future()
+        self.coordinator.send("login", username)
+        try:
+            return await self.logins[username]
+        finally:
+            del self.logins[username]
+
+    def on_message(self, message):
+        kind = message[0]
+        if kind == "login":
+            _, username, success = message
+            if username in self.logins:
+                self.logins[username].set_result(success)
+        elif kind == "start":
+            task = asyncio.create_task(self.host_game(*message[1:]))
+            self.games.add(task)
+            task.add_done_callback(self.games.discard)
+        elif kind == "send":
+            # relayed message for a local player in a game hosted elsewhere
+            _, username, data = message
+            if username in self.players:
+                task = asyncio.create_task(self.send_quietly(self.players[username], data))
+                self.sends.add(task)
+                task.add_done_callback(self.sends.discard)
+        elif kind == "recv":
+            # message from a remote player in a game hosted here
+            _, username, data = message
+            if username in self.relays:
+                self.relays[username].inbox.put_nowait(data)
+        elif kind == "attach":
+            self.start_pump(message[1])
+        elif kind == "detach":
+            self.stop_pump(message[1])
+
+    async def send_quietly(self, player, data):
+        try:
+            await player.send_message(data)
+        except Exception:
+            # the hosting shard notices through the turn timeout
+            pass
+
+    def start_pump(self, username):
+        if username in self.players and username not in self.pumps:
+            self.pumps[username] = asyncio.create_task(self.pump(self.players[username]))
+
+    def stop_pump(self, username):
+        pump = self.pumps.pop(username, None)
+        if pump:
+            pump.cancel()
+
+    async def pump(self, player):
+        """
+        Forwards everything a local player sends to the shard hosting their game.
+        """
+        while True:
+            data = await player.websocket.recv()
+            self.coordinator.send("forward", player.username, data)
+
+    def shard_player(self, username, remote, encoding):
+        if remote:
+            relay = RelayWebsocket(self.coordinator, username)
+            self.relays[username] = relay
+            return Player(relay, username, encoding=encoding)
+        return self.players.get(username)
+
+    async def host_game(self, game_id, username1, remote1, username2, remote2, encoding2):
+        p1 = self.shard_player(username1, remote1, None)
+        p2 = self.shard_player(username2, remote2, encoding2)
+        results = (None, tuple(username for username, player in
+                               ((username1, p1), (username2, p2)) if player is None))
+        num_turns = None
+        try:
+            if not results[1]:
+                match = GameController(p1, p2, game_id)
+                await match.play_game()
+                self.replays.write_match(match)
+                results = match.get_results()
+                num_turns = match.get_num_turns()
+        finally:
+            for username, remote, player in ((username1, remote1, p1), (username2, remote2, p2)):
+                if remote:
+                    self.relays.pop(username, None)
+                    # the last messages are relayed before the result, so
+                    # they reach the player before the coordinator detaches
+                    if player is not None:
+                        await player.aclose()
+            self.coordinator.send("result", game_id, results, num_turns)
+
+
+def run_shard(shard_id, conn, port, metrics_port):
+    log.setup_logging()
+    asyncio.run(Shard(shard_id, conn).run(port, metrics_port))
+
+
+class ShardPlayer:
+    """
+    Coordinator view of a logged in player: the username, owning shard and
+    wire encoding.
+    """
+
+    def __init__(self, username, shard, encoding):
+        self.username = username
+        self.shard = shard
+        self.encoding = encoding
+        # heartbeats are handled by the shard owning the connection, which
+        # reports changes
+        self.responsive = True
+
+    def __repr__(self):
+        return f"ShardPlayer({self.username}, {self.shard})"
+
+
+class FinishedGame:
+    """
+    Coordinator view of a game played on a shard, with the parts of the
+    GameController interface used by the Matchmaker and ResultsStore.
+    """
+
+    def __init__(self, game_id, player1, player2, results, num_turns):
+        self.id = game_id
+        self.player1 = player1
+        self.player2 = player2
+        self.results = results
+        self.num_turns = num_turns
+
+    def get_id(self):
+        return self.id
+
+    def get_num_turns(self):
+        return self.num_turns
+
+    def get_results(self):
+        return self.results
+
+
+class Coordinator:
+    """
+    Keeps the global registry of players, matches them with a Matchmaker and
+    routes relayed messages between shards.
+
+    Representation:
+    shards: list of ShardConnections, indexed by shard id
+    players: dictionary mapping usernames to ShardPlayers
+    pending: usernames that passed the login check but are not ready yet
+    relay_hosts: maps usernames of relayed players to the shard hosting their game
+    results: futures of games in progress, keyed by game id
+    results_store: ResultsStore the game results are recorded in
+    """
+
+    def __init__(self, conns):
+        self.conns = conns
+        self.shards = []
+        self.players = dict()
+        self.pending = set()
+        self.relay_hosts = dict()
+        self.results = dict()
+        self.results_store = ResultsStore()
+        self.ratings = Ratings(self.results_store)
+        self.matchmaker = Matchmaker(self.players, self.play_game, self.results_store,
+                                     self.ratings, self.ratings.pair_players)
+
+    async def run(self):
+        await self.ratings.load()
+        for shard_id, conn in enumerate(self.conns):
+            self.shards.append(ShardConnection(
+                conn, lambda message, shard_id=shard_id: self.on_message(shard_id, message)))
+        try:
+            await asyncio.Future()
+        finally:
+            # write the buffered results
+            await self.results_store.close()
+
+    def on_message(self, shard_id, message):
+        kind = message[0]
+        if kind == "login":
+            username = message[1]
+            success = username not in self.players and username not in self.pending
+            if success:
+                self.pending.add(username)
+            self.shards[shard_id].send("login", username, success)
+        elif kind == "ready":
+            _, username, encoding = message
+            self.pending.discard(username)
+            player = ShardPlayer(username, shard_id, encoding)
+            self.players[username] = player
+            logger.info("logged in %s on shard %d", username, shard_id)
+            self.matchmaker.add(player)
+        elif kind == "logout":
+            username = message[1]
+            player = self.players.pop(username, None)
+            if player:
+                self.matchmaker.remove(player)
+        elif kind == "responsive":
+            _, username, responsive = message
+            player = self.players.get(username)
+            if player:
+                player.responsive = responsive
+                logger.info("%s is %s", username, "responsive" if responsive else "unresponsive")
+                if responsive:
+                    self.matchmaker.add(player)
+        elif kind == "relay":
+            # hosting shard -> shard owning the player
+            _, username, data = message
+            if username in self.players:
+                self.shards[self.players[username].shard].send("send", username, data)
+        elif kind == "forward":
+            # shard owning the player -> hosting shard
+            _, username, data = message
+            if username in self.relay_hosts:
+                self.shards[self.relay_hosts[username]].send("recv", username, data)
+        elif kind == "result":
+            _, game_id, results, num_turns = message
+            if game_id in self.results:
+                self.results.pop(game_id).set_result((results, num_turns))
+
+    async def play_game(self, pair):
+        """
+        Plays a game on the shard of the first player, relaying the second
+        player's messages if they are connected to a different shard.
+        Returns a FinishedGame.
+        """
+        p1, p2 = pair
+        host = p1.shard
+        remote = p2.shard != host
+        game_id = str(uuid.uuid4())
+        self.results[game_id] = asyncio.get_running_loop().create_future()
+        if remote:
+            self.relay_hosts[p2.username] = host
+            self.shards[p2.shard].send("attach", p2.username)
+        try:
+            self.shards[host].send("start", game_id, p1.username, False, p2.username, remote, p2.encoding)
+            results, num_turns = await self.results[game_id]
+            return FinishedGame(game_id, p1, p2, results, num_turns)
+        finally:
+            self.results.pop(game_id, None)
+            if remote:
+                self.relay_hosts.pop(p2.username, None)
+                self.shards[p2.shard].send("detach", p2.username)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the game server across several processes.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of shards (default: all cores)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--metrics-port", type=int, default=metrics.METRICS_PORT,
+                        help="metrics port of shard 0; shard i uses this port + i")
+    args = parser.parse_args()
+
+    conns = []
+    for shard_id in range(args.workers):
+        coordinator_end, shard_end = multiprocessing.Pipe()
+        multiprocessing.Process(target=run_shard, args=(shard_id, shard_end, args.port, args.metrics_port), daemon=True).start()
+        conns.append(coordinator_end)
+    log.setup_logging()
+    asyncio.run(Coordinator(conns).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Regression tests for turn message parsing and the send queue. Run from the
+server directory:
+    python -m pytest -q
+"""
+import asyncio
+import json
+from player import (Player, decode_turn_actions, decode_binary_turn, MESSAGES_COALESCED,
+                    MESSAGES_DROPPED, COALESCE)
+from game import NUM_BOTS
+import protocol
+import pytest
+
+GAME_ID = "game"
+BINARY_GAME_ID = "12345678-1234-5678-1234-567812345678"
+
+
+def turn_message(actions):
+    return json.dumps({"type": "turn", "game_id": GAME_ID, "turn": 1, "actions": actions})
+
+
+@pytest.mark.parametrize("action_type", [[], {}, ["load"], {"load": 1}, 1, None])
+def test_unhashable_or_non_string_action_type_is_rejected(action_type):
+    actions = [{"type": action_type}] + [{"type": "load"}] * (NUM_BOTS - 1)
+    assert decode_turn_actions(actions) is None
+    assert Player(None, "player").parse_turn_message(GAME_ID, turn_message(actions)) is None
+
+
+def test_deeply_nested_message_is_rejected():
+    # valid json, but nested deeper than the recursion limit
+    message = "[" * 990 + "]" * 990
+    assert Player(None, "player").parse_turn_message(GAME_ID, message) is None
+
+
+def test_valid_turn_is_decoded():
+    actions = [{"type": "load"}, {"type": "launch", "target": 1, "strength": 1}, {"type": "shield"}]
+    decoded = Player(None, "player").parse_turn_message(GAME_ID, turn_message(actions))
+    assert [action.type for action in decoded] == [1, 2, 3]
+
+
+@pytest.mark.parametrize("action", [
+    {"type": "launch", "target": 1, "strength": True},
+    {"type": "launch", "target": False, "strength": 1},
+    {"type": "launch", "target": 1, "strength": 1.0},
+    {"type": "load", "strength": True},
+])
+def test_encodings_reject_the_same_actions(action):
+    actions = [action] + [{"type": "load"}] * (NUM_BOTS - 1)
+    assert decode_turn_actions(actions) is None
+    assert protocol.encode_turn(BINARY_GAME_ID, 1, actions) is None
+
+
+def test_binary_turn_matches_json_turn():
+    actions = [{"type": "load"}, {"type": "launch", "target": 1, "strength": 1}, {"type": "shield"}]
+    message = protocol.encode_turn(BINARY_GAME_ID, 1, actions)
+    assert decode_binary_turn(BINARY_GAME_ID, message) == decode_turn_actions(actions)
+
+
+class RecordingWebsocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        await asyncio.sleep(0)
+        self.sent.append(message)
+
+
+def test_aclose_sends_queued_messages_and_stops_writer():
+    async def run():
+        websocket = RecordingWebsocket()
+        player = Player(websocket, "player")
+        for i in range(3):
+            player.queue_message(str(i))
+        await player.aclose()
+        await asyncio.sleep(0)
+        return websocket.sent, player.writer
+    sent, writer = asyncio.run(run())
+    assert sent == ["0", "1", "2"]
+    assert writer.done()
+
+
+def test_overflow_updates_queue_metrics():
+    async def run():
+        player = Player(RecordingWebsocket(), "player", queue_size=2, overflow=COALESCE)
+        # the writer does not run until the test yields, so the queue fills up
+        player.queue_message("update 1", is_game_update=True)
+        player.queue_message("over 1")
+        player.queue_message("over 2")
+        player.queue_message("over 3")
+        await player.aclose()
+    coalesced, dropped = MESSAGES_COALESCED.values.get((), 0), MESSAGES_DROPPED.values.get((), 0)
+    asyncio.run(run())
+    assert MESSAGES_COALESCED.values.get((), 0) == coalesced + 1
+    assert MESSAGES_DROPPED.values.get((), 0) == dropped + 1
@@ -0,0 +1,16 @@
+"""
+Regression tests for reading replay archives. Run from the server directory:
+    python -m pytest -q
+"""
+import pytest
+from replay import ReplayReader
+
+
+@pytest.mark.parametrize("contents", [b"", b"CP"])
+def test_file_without_header_has_no_games(tmp_path, contents):
+    # what is left when the server crashes before its first write
+    path = tmp_path / "crashed.replay"
+    path.write_bytes(contents)
+    reader = ReplayReader(str(path))
+    assert len(reader) == 0
+    reader.close()
@@ -0,0 +1,24 @@
+"""
+Regression tests for the results store. Run from the server directory:
+    python -m pytest -q
+"""
+import asyncio
+from results_store import ResultsStore
+
+
+def test_duplicate_game_counts_once_in_standings(tmp_path):
+    async def run():
+        store = ResultsStore(str(tmp_path / "results.db"))
+        try:
+            store.record("a", "b", "a", (), 10, game_id="game")
+            store.record("a", "b", "a", (), 10, game_id="game")
+            await store.flush()
+            # already stored by an earlier batch
+            store.record("a", "b", "a", (), 10, game_id="game")
+            await store.flush()
+            return {row["player"]: row for row in await store.leaderboard()}
+        finally:
+            await store.close()
+    standings = asyncio.run(run())
+    assert standings["a"]["played"] == 1 and standings["a"]["won"] == 1
+    assert standings["b"]["played"] == 1 and standings["b"]["lost"] == 1
@@ -1,40 +1,299 @@
 import asyncio
 from player import GameController
+import json
+import math
+import os
 import random
+import time
+import log
 
-async def run_tourney(players):
+logger = log.get_logger("tournament")
+
+# maximum number of tournament games played at once
+MAX_CONCURRENT_GAMES = 64
+# number of rounds of a swiss tournament; None for log2 of the number of players
+SWISS_ROUNDS = None
+# files saving tournaments in progress, see TournamentCheckpoint
+TOURNEY_CHECKPOINT = "tournament_checkpoint.jsonl"
+SWISS_CHECKPOINT = "swiss_checkpoint.jsonl"
+
+
+async def run_tourney(players, results_store=None, ratings=None, max_concurrent=MAX_CONCURRENT_GAMES,
+                      checkpoint=TOURNEY_CHECKPOINT, replays=None):
     """
-    Runs a complete round-robin tournament.
-    \nArgs: players, a dictionary keyed on player ids
+    Runs a complete round-robin tournament, one round at a time. Every player
+    plays at most one game per round, so the games of a round run in parallel
+    (at most max_concurrent at once) without waiting on each other's locks.
+
+    Results are saved to the checkpoint file as games end. If the file is left
+    over from an interrupted tournament, its games are not played again.
+    \nArgs: players, a dictionary keyed on player ids, optionally a
+    ResultsStore to record the games in and Ratings to update, the 
+    checkpoint file name (None to disable checkpointing) and a ReplayWriter
+    to save the games to.
     Prints out the ranking of players in a formatted fashion.
     """
     # if no players, print that to console
     if len(players) < 2:
-        print(f"{len(players)} players present, so no tournament can run!")
+        logger.warning("%d players present, so no tournament can run!", len(players))
         return
-    match_schedule = generate_schedule(players)
-    # player rankings: { player_id: { "played":, "won":, "lost":, "tied":, } }
-    rankings = { 
-        player: { "played": 0, "won": 0, "lost": 0, "tied": 0, } 
-        for player in players 
-    }
-    # intitialize list of awaiting games
-    waiting_list = []
-    # make a list of our game runnables
-    for match in match_schedule:
-        waiting_list.append(tourney_game((players[match[0]], players[match[1]])))
-    # run all games
-    if waiting_list:
-        # collect results
-        results = await asyncio.gather(*waiting_list)
-        # apply results to rankings
-        for result in results:
-            handle_outcome(result, rankings)
+    # players who disconnect during the tournament still lose their games
+    players = dict(players)
+    rankings = new_rankings(players)
+    saved = TournamentCheckpoint(checkpoint, "round_robin")
+    played = set()
+    for result in saved.results:
+        if result["player1"] in rankings and result["player2"] in rankings:
+            apply_result(result["player1"], result["player2"], result["winner"], rankings)
+            played.add(tuple(sorted((result["player1"], result["player2"]))))
+    if played:
+        logger.info("resuming tournament: %d games already played", len(played))
+
+    rounds = generate_rounds(players)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    for round_number, matches in enumerate(rounds):
+        start = time.monotonic()
+        matches = [match for match in matches if tuple(sorted(match)) not in played]
+        await play_round(matches, players, rankings, semaphore, results_store, ratings,
+                         saved, round_number, replays)
+        logger.info("tournament round %d/%d done: %d games in %.1f seconds",
+                    round_number + 1, len(rounds), len(matches), time.monotonic() - start)
+    saved.finish()
     # print our list of player_ids, sorted by rank
     new_ranks = rank_sort(rankings)
     print_results(new_ranks)
 
 
+async def run_swiss(players, num_rounds=SWISS_ROUNDS, results_store=None, ratings=None,
+                    max_concurrent=MAX_CONCURRENT_GAMES, checkpoint=SWISS_CHECKPOINT, replays=None):
+    """
+    Runs a swiss tournament: each round pairs players with similar points
+    who have not played each other yet, so a ranking emerges after about
+    log2(n) rounds instead of the n-1 rounds of a round-robin.
+
+    Pairings and results are saved to the checkpoint file like in run_tourney.
+    An interrupted tournament resumes with the unfinished games of its last
+    round.
+    \nArgs: players, a dictionary keyed on player ids, the number of rounds
+    (log2 of the number of players if None), optionally a ResultsStore 
+    to record the games in and Ratings to update, the checkpoint file
+    name (None to disable checkpointing) and a ReplayWriter to save the
+    games to.
+    Prints out the ranking of players in a formatted fashion.
+    """
+    if len(players) < 2:
+        logger.warning("%d players present, so no tournament can run!", len(players))
+        return
+    players = dict(players)
+    num_rounds = num_rounds or math.ceil(math.log2(len(players)))
+    rankings = new_rankings(players)
+    saved = TournamentCheckpoint(checkpoint, "swiss", num_rounds=num_rounds)
+    num_rounds = saved.options["num_rounds"]
+    semaphore = asyncio.Semaphore(max_concurrent)
+    byes = set()
+
+    def start_round(bye):
+        if bye is not None and bye in rankings:
+            # a bye counts as a win, and each player gets at most one
+            byes.add(bye)
+            rankings[bye]["played"] += 1
+            rankings[bye]["won"] += 1
+
+    # replay the saved rounds, then finish the games of the last one
+    finished = dict()
+    for result in saved.results:
+        if result["player1"] in rankings and result["player2"] in rankings:
+            apply_result(result["player1"], result["player2"], result["winner"], rankings)
+        finished.setdefault(result["round"], []).append((result["player1"], result["player2"]))
+    for round_record in saved.rounds:
+        start_round(round_record["bye"])
+    if saved.rounds:
+        round_number = len(saved.rounds) - 1
+        logger.info("resuming swiss tournament in round %d/%d", round_number + 1, num_rounds)
+        matches = [tuple(match) for match in saved.rounds[-1]["matches"]]
+        for match in finished.get(round_number, ()):
+            if match in matches:
+                matches.remove(match)
+        matches = [match for match in matches if match[0] in players and match[1] in players]
+        await play_round(matches, players, rankings, semaphore, results_store, ratings,
+                         saved, round_number, replays)
+
+    for round_number in range(len(saved.rounds), num_rounds):
+        start = time.monotonic()
+        matches, bye = swiss_pairings(rankings, byes)
+        saved.record_round(matches, bye)
+        start_round(bye)
+        await play_round(matches, players, rankings, semaphore, results_store, ratings,
+                         saved, round_number, replays)
+        logger.info("swiss round %d/%d done: %d games in %.1f seconds",
+                    round_number + 1, num_rounds, len(matches), time.monotonic() - start)
+    saved.finish()
+    print_results(rank_sort(rankings))
+
+
+# fields of the round and result lines of a checkpoint
+ROUND_FIELDS = ("matches", "bye")
+RESULT_FIELDS = ("round", "player1", "player2", "winner", "errored")
+
+
+class TournamentCheckpoint:
+    """
+    Append-only json lines file saving a tournament in progress: a first line
+    describing the tournament, then its rounds (swiss only) and the results of
+    its games in the order they were played. The file is deleted when the 
+    tournament ends, so a file found at the start belongs to an interrupted
+    tournament, and its contents are loaded to resume it.
+
+    Representation:
+    path: file name, or None if checkpointing is disabled
+    mode: "round_robin" or "swiss"; a file of another mode is discarded
+    options: tournament settings saved in the first line
+    rounds: loaded round lines, { "round":, "matches":, "bye": }
+    results: loaded result lines, { "round":, "player1":, "player2":, "winner":, "errored": }
+    """
+
+    def __init__(self, path, mode, **options):
+        self.path = path
+        self.mode = mode
+        self.options = options
+        self.rounds = []
+        self.results = []
+        self.file = None
+        if path is None:
+            return
+        valid_bytes = self.load()
+        if valid_bytes:
+            # drop a line cut off by a crash before appending to the file
+            self.file = open(path, "r+")
+            self.file.truncate(valid_bytes)
+            self.file.seek(valid_bytes)
+        else:
+            self.file = open(path, "w")
+            self.write({"type": "start", "mode": mode, **options})
+
+    def load(self):
+        """
+        Loads an existing checkpoint of the same mode. Returns the length in
+        bytes of its complete lines, or 0 if there is nothing to resume.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+        valid_bytes = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except (ValueError, RecursionError):
+                break
+            if type(record) is not dict:
+                break
+            if valid_bytes == 0:
+                if record.get("type") != "start" or record.get("mode") != self.mode:
+                    logger.warning("ignoring checkpoint %s of another tournament", self.path)
+                    return 0
+                self.options = {key: value for key, value in record.items() if key not in ("type", "mode")}
+            elif record.get("type") == "round" and all(field in record for field in ROUND_FIELDS):
+                self.rounds.append(record)
+            elif record.get("type") == "result" and all(field in record for field in RESULT_FIELDS):
+                self.results.append(record)
+            else:
+                # unrecognized line: resume from the lines before it, like a
+                # line cut off by a crash
+                logger.warning("checkpoint %s has an unrecognized line, ignoring the rest", self.path)
+                break
+            valid_bytes += len(line)
+        return valid_bytes
+
+    def write(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def record_round(self, matches, bye):
+        self.write({"type": "round", "round": len(self.rounds), "matches": matches, "bye": bye})
+        self.rounds.append({"matches": matches, "bye": bye})
+
+    def record_result(self, round_number, player1, player2, winner, errored):
+        self.write({"type": "result", "round": round_number, "player1": player1,
+                    "player2": player2, "winner": winner, "errored": errored})
+
+    def finish(self):
+        """
+        Deletes the checkpoint of a finished tournament.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.remove(self.path)
+
+
+def new_rankings(players):
+    """
+    Returns empty rankings for the players: 
+    { player_id: { "played":, "won":, "lost":, "tied":, "opponents": [] } }
+    """
+    return { 
+        player: { "played": 0, "won": 0, "lost": 0, "tied": 0, "opponents": [], } 
+        for player in players 
+    }
+
+
+async def play_round(matches, players, rankings, semaphore, results_store=None, ratings=None,
+                     checkpoint=None, round_number=0, replays=None):
+    """
+    Plays the matches of a round in parallel, at most as many at once as the
+    semaphore allows, applying each result to rankings and saving it to the
+    checkpoint as soon as it ends.
+    """
+    async def play(match):
+        async with semaphore:
+            result = await tourney_game((players[match[0]], players[match[1]]), replays)
+        handle_outcome(result, rankings)
+        if checkpoint is not None:
+            checkpoint.record_result(round_number, result.player1.username, result.player2.username,
+                                     *result.get_results())
+        if results_store is not None:
+            results_store.record_match(result, mode="tournament")
+        if ratings is not None:
+            ratings.update(result.player1.username, result.player2.username, *result.get_results())
+
+    await asyncio.gather(*(play(match) for match in matches))
+
+
+def swiss_pairings(rankings, byes=()):
+    """
+    Pairs players for the next swiss round. Players are taken in order of
+    points (randomly within equal points) and each is paired with the best
+    placed remaining player they have not played yet, or the best placed
+    remaining player if they have played all of them.
+    \nArgs: rankings, and the set of player ids that already had a bye
+    \nReturns: a list of tuples (player1_id, player2_id), and the player id
+    sitting out this round (None with an even number of players).
+    """
+    order = sorted(generate_players(rankings), key=lambda player: points(rankings[player]), reverse=True)
+    bye = None
+    if len(order) % 2 == 1:
+        # the lowest placed player who has not had a bye yet sits out
+        bye = next((player for player in reversed(order) if player not in byes), order[-1])
+        order.remove(bye)
+    matches = []
+    while order:
+        player_id = order.pop(0)
+        played = set(rankings[player_id]["opponents"])
+        opp_index = next((i for i, opp_id in enumerate(order) if opp_id not in played), 0)
+        matches.append((player_id, order.pop(opp_index)))
+    return matches, bye
+
+
+def points(results):
+    """
+    Returns the points of a rankings entry: 3 per win, 1 per tie.
+    """
+    return 3*results["won"] + results["tied"]
+
+
 def print_results(rankings):
     """
     Args: rankings, a list of player ids in descending rank order.\n
@@ -54,13 +313,35 @@ def generate_schedule(players):
     \nReturns: a set of tuples (player1_id, player2_id), every 2-element
     permutation of player ids.
     """
+    return set(tuple(sorted(match)) for matches in generate_rounds(players) for match in matches)
+
+
+def generate_rounds(players):
+    """
+    Splits the round-robin into rounds with the circle method: one player
+    stays in place while the others rotate around them, so that each round
+    pairs every player at most once.
+    \nArgs: players, a dictionary keyed on player ids
+    \nReturns: a list of n-1 rounds (n rounded up to even), each a list of
+    tuples (player1_id, player2_id). With an odd number of players, one
+    player sits out each round.
+    """
     player_ids = generate_players(players)
-    match_schedule = set()
-    for player_idx, player_id in enumerate(player_ids):
-        opponents = player_ids[:player_idx] + player_ids[player_idx+1:]
-        for opp_id in opponents:
-            match_schedule.add(tuple(sorted((player_id, opp_id))))
-    return match_schedule
+    if len(player_ids) % 2 == 1:
+        # whoever is paired with None sits out the round
+        player_ids.append(None)
+    num_players = len(player_ids)
+    rounds = []
+    for _ in range(num_players - 1):
+        matches = []
+        for i in range(num_players // 2):
+            player_id, opp_id = player_ids[i], player_ids[num_players - 1 - i]
+            if player_id is not None and opp_id is not None:
+                matches.append((player_id, opp_id))
+        rounds.append(matches)
+        # keep the first player in place and rotate the others by one
+        player_ids = [player_ids[0], player_ids[-1]] + player_ids[1:-1]
+    return rounds
 
 
 def generate_players(players):
@@ -72,17 +353,20 @@ def generate_players(players):
     return player_ids
 
 
-async def tourney_game(competitors):
+async def tourney_game(competitors, replays=None):
     """
     Given a tuple of competitors and a rankings dict, run a game between them.
     Mutate rankings with each players' match results.
     The two players should not currently be in a game.
+    If a ReplayWriter is given, the game is saved to it.
     """
     # get our two competitors
     p1, p2 = competitors
     # run our game
     match = GameController(p1, p2)
     await match.play_game()
+    if replays is not None:
+        replays.write_match(match)
     # return match object
     return match
 
@@ -92,13 +376,19 @@ def handle_outcome(match, rankings):
     Given a GameController that is completed, mutates a rankings 
     dict keyed on player_id to reflect the outcome. 
     """
-    p1 = match.player1.username
-    p2 = match.player2.username
-    results = match.get_results()
+    apply_result(match.player1.username, match.player2.username, match.get_results()[0], rankings)
+
+
+def apply_result(p1, p2, winner, rankings):
+    """
+    Mutates a rankings dict keyed on player_id to reflect a game between
+    p1 and p2 won by winner (None for a tie).
+    """
     # handle win/loss outcome
-    winner = results[0]
     rankings[p1]["played"] += 1
     rankings[p2]["played"] += 1
+    rankings[p1].setdefault("opponents", []).append(p2)
+    rankings[p2].setdefault("opponents", []).append(p1)
     # if winner = None, we have a tie
     if not winner:
         rankings[p1]["tied"] += 1
@@ -119,8 +409,8 @@ def rank_sort(rankings):
      - Tie = 1 pt.
      - Loss = 0 pts.\n
     Divided by games played, creating a pts/game ranking.\n
-    pts/game ties are broken by # of wins, then head to head result,
-    then a coin flip.
+    pts/game ties are broken by # of wins, then Buchholz score (the sum
+    of the points of every opponent played), then a coin flip.
     """
     new_ranks = { player_id: {"win_pct": 0, "won": rankings[player_id]["won"],} for player_id in generate_players(rankings) }
     for player_id, results in rankings.items():
@@ -129,5 +419,7 @@ def rank_sort(rankings):
             (1*results["tied"])) /
             results["played"] * 10000
         ) / 10000
-    sorted_rank = sorted(new_ranks.items(), key=lambda x: (x[1]["win_pct"], x[1]["won"]), reverse=True)
+        new_ranks[player_id]["buchholz"] = sum(
+            points(rankings[opp_id]) for opp_id in results.get("opponents", ()))
+    sorted_rank = sorted(new_ranks.items(), key=lambda x: (x[1]["win_pct"], x[1]["won"], x[1]["buchholz"]), reverse=True)
     return [ rank[0] for rank in sorted_rank ]